@@ -0,0 +1,233 @@
+# admission.py
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BATCH = 1
+    REPORT = 2
+
+
+# Priority of the work being done in the current request or job
+priority_var = contextvars.ContextVar('priority', default=Priority.INTERACTIVE)
+
+
+class AdmissionRejected(RuntimeError):
+    """Raised when upstream work cannot be admitted before its queue deadline."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        Initialize a token bucket
+
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens, i.e. the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Take a token if one is available."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self, count=1):
+        """Seconds until ``count`` tokens are available."""
+        self._refill()
+        return max(0.0, (count - self.tokens) / self.rate)
+
+
+class AdmissionController:
+    # Buckets and queues live in this process: priorities order waiters within one
+    # process only. Other processes (gunicorn workers, warmup.py) have their own
+    # limits, so the per-process rates must add up to no more than the upstream quota.
+
+    # Default requests per second and burst per upstream
+    DEFAULT_LIMITS = {'openai': (20, 40), 'bigquery': (10, 20)}
+    # Default seconds a request of each priority may wait in the queue
+    DEFAULT_DEADLINES = {Priority.INTERACTIVE: 15, Priority.BATCH: 60, Priority.REPORT: 300}
+
+    def __init__(self, limits=None, deadlines=None, max_queue=None):
+        """
+        Initialize admission control for upstream calls
+
+        :param limits: {upstream: (rate, burst)}, defaults from ADMISSION_<UPSTREAM>_RATE/_BURST
+        :param deadlines: {Priority: seconds} a request may wait before it is rejected
+        :param max_queue: Waiters per upstream beyond which requests are rejected immediately
+        """
+        limits = limits or {
+            name: (
+                float(os.getenv(f"ADMISSION_{name.upper()}_RATE", rate)),
+                float(os.getenv(f"ADMISSION_{name.upper()}_BURST", burst)),
+            )
+            for name, (rate, burst) in self.DEFAULT_LIMITS.items()
+        }
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in limits.items()}
+        self.deadlines = deadlines or {
+            priority: float(os.getenv(f"ADMISSION_{priority.name}_DEADLINE", seconds))
+            for priority, seconds in self.DEFAULT_DEADLINES.items()
+        }
+        self.max_queue = int(max_queue or os.getenv("ADMISSION_MAX_QUEUE", "200"))
+        self._waiters = {name: [] for name in self.buckets}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._metrics = {
+            name: {p: {'admitted': 0, 'rejected': 0, 'wait_sum': 0.0, 'wait_max': 0.0} for p in Priority}
+            for name in self.buckets
+        }
+
+    def _enqueue(self, upstream, priority):
+        waiters = self._waiters[upstream]
+        if len(waiters) >= self.max_queue:
+            self._metrics[upstream][priority]['rejected'] += 1
+            raise AdmissionRejected(
+                f"The service is busy ({upstream} queue is full). Please try again in a few seconds."
+            )
+        # Fail fast if the waiters already ahead cannot be admitted before our deadline
+        ahead = sum(1 for p, _ in waiters if p <= priority)
+        if self.buckets[upstream].time_until_token(ahead + 1) > self.deadlines[priority]:
+            self._metrics[upstream][priority]['rejected'] += 1
+            raise self._rejection(upstream, priority)
+        entry = (priority, next(self._sequence))
+        heapq.heappush(waiters, entry)
+        return entry
+
+    def _try_admit(self, upstream, entry):
+        """Admit ``entry`` if it is first in line and a token is available."""
+        waiters = self._waiters[upstream]
+        if waiters[0] == entry and self.buckets[upstream].try_take():
+            heapq.heappop(waiters)
+            return True
+        return False
+
+    def _leave(self, upstream, entry, priority, waited, admitted):
+        waiters = self._waiters[upstream]
+        if entry in waiters:
+            waiters.remove(entry)
+            heapq.heapify(waiters)
+        metrics = self._metrics[upstream][priority]
+        if admitted:
+            metrics['admitted'] += 1
+            metrics['wait_sum'] += waited
+            metrics['wait_max'] = max(metrics['wait_max'], waited)
+        else:
+            metrics['rejected'] += 1
+
+    def _abandon(self, upstream, entry, priority, waited):
+        """Remove a waiter that stopped waiting, e.g. a cancelled task, so it does not block the queue."""
+        if entry in self._waiters[upstream]:
+            self._leave(upstream, entry, priority, waited, False)
+            self._cond.notify_all()
+
+    def _rejection(self, upstream, priority):
+        return AdmissionRejected(
+            f"The service is busy ({upstream} capacity exhausted for {priority.name.lower()} requests). "
+            "Please try again in a few seconds."
+        )
+
+    def acquire(self, upstream, priority=None):
+        """
+        Wait for permission to call an upstream, highest priority first
+
+        :param upstream: Upstream name, e.g. "openai" or "bigquery"
+        :param priority: Priority of the call, defaults to the current request's priority
+        :raises AdmissionRejected: If the queue is full, the wait is estimated to exceed the deadline,
+            or the deadline passes while waiting
+        """
+        if upstream not in self.buckets:
+            return
+        priority = Priority(priority if priority is not None else priority_var.get())
+        start = time.monotonic()
+        deadline = start + self.deadlines[priority]
+
+        with self._cond:
+            entry = self._enqueue(upstream, priority)
+            try:
+                while True:
+                    if self._try_admit(upstream, entry):
+                        self._leave(upstream, entry, priority, time.monotonic() - start, True)
+                        self._cond.notify_all()
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._leave(upstream, entry, priority, time.monotonic() - start, False)
+                        self._cond.notify_all()
+                        raise self._rejection(upstream, priority)
+                    self._cond.wait(min(remaining, max(self.buckets[upstream].time_until_token(), 0.01)))
+            except BaseException:
+                self._abandon(upstream, entry, priority, time.monotonic() - start)
+                raise
+
+    async def acquire_async(self, upstream, priority=None):
+        """Async variant of acquire that waits without blocking the event loop."""
+        if upstream not in self.buckets:
+            return
+        priority = Priority(priority if priority is not None else priority_var.get())
+        start = time.monotonic()
+        deadline = start + self.deadlines[priority]
+
+        with self._cond:
+            entry = self._enqueue(upstream, priority)
+        try:
+            while True:
+                with self._cond:
+                    if self._try_admit(upstream, entry):
+                        self._leave(upstream, entry, priority, time.monotonic() - start, True)
+                        self._cond.notify_all()
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._leave(upstream, entry, priority, time.monotonic() - start, False)
+                        self._cond.notify_all()
+                        raise self._rejection(upstream, priority)
+                    wait = min(remaining, max(self.buckets[upstream].time_until_token(), 0.01))
+                await asyncio.sleep(wait)
+        except BaseException:
+            # Cancellation lands in the sleep; leave the queue so later callers are not blocked
+            with self._cond:
+                self._abandon(upstream, entry, priority, time.monotonic() - start)
+            raise
+
+    def metrics_text(self):
+        """Render queue depth, wait time and rejections in Prometheus text format."""
+        lines = [
+            "# HELP admission_queue_depth Requests waiting for an upstream.",
+            "# TYPE admission_queue_depth gauge",
+        ]
+        with self._cond:
+            for upstream, waiters in self._waiters.items():
+                for priority in Priority:
+                    depth = sum(1 for p, _ in waiters if p == priority)
+                    lines.append(f'admission_queue_depth{{upstream="{upstream}",priority="{priority.name.lower()}"}} {depth}')
+
+            counters = [
+                ('admission_admitted_total', 'counter', 'admitted', 'Requests admitted to an upstream.'),
+                ('admission_rejected_total', 'counter', 'rejected', 'Requests rejected by admission control.'),
+                ('admission_wait_seconds_sum', 'counter', 'wait_sum', 'Total queue wait of admitted requests.'),
+                ('admission_wait_seconds_max', 'gauge', 'wait_max', 'Longest queue wait of an admitted request.'),
+            ]
+            for name, kind, key, help_text in counters:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for upstream, by_priority in self._metrics.items():
+                    for priority, metrics in by_priority.items():
+                        lines.append(f'{name}{{upstream="{upstream}",priority="{priority.name.lower()}"}} {metrics[key]}')
+        return "\n".join(lines) + "\n"
@@ -1,14 +1,68 @@
 # analysis.py
-import json
-import pandas as pd
+from resultframe import format_dates
+from contextcompactor import ContextCompactor
+from modelrouter import ModelRouter
+from admission import AdmissionRejected
 
 class DataAnalyzer:
-    def __init__(self, openai_client):
+    EMPTY_RESULT_FALLBACK = "No matching data was found for your query. Please try adjusting your search criteria."
+
+    def __init__(self, openai_client, async_openai_client=None, model_router=None):
         self.client = openai_client
+        self.async_client = async_openai_client
+        self.router = model_router or ModelRouter()
+        self.context_compactor = ContextCompactor()
 
 
     def analyze_data(self, df, user_query, results_df):
         """Analyze the DataFrame using OpenAI."""
+        request = self._analysis_request(df, user_query, results_df)
+        try:
+            response = self.router.complete(self.client, request, 'analysis', self._score(df, user_query))
+            return self._format_analysis(df, response)
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            if df is None or df.empty:
+                return self.EMPTY_RESULT_FALLBACK
+            return f"Analysis error: {str(e)}"
+
+    async def analyze_data_async(self, df, user_query, results_df):
+        """Async variant of analyze_data."""
+        request = self._analysis_request(df, user_query, results_df)
+        try:
+            response = await self.router.complete_async(
+                self.async_client, request, 'analysis', self._score(df, user_query)
+            )
+            return self._format_analysis(df, response)
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            if df is None or df.empty:
+                return self.EMPTY_RESULT_FALLBACK
+            return f"Analysis error: {str(e)}"
+
+    def _score(self, df, user_query):
+        """Complexity score for routing; empty results need only a short reply."""
+        if df is None or df.empty:
+            return 0
+        return self.router.score_complexity(user_query)
+
+    @staticmethod
+    def _format_analysis(df, response):
+        """Extract the analysis text and ensure consistent formatting."""
+        analysis_text = response.choices[0].message.content.strip()
+        if df is None or df.empty:
+            return analysis_text
+
+        # Ensure consistent formatting
+        if not analysis_text.startswith('•') and not analysis_text.startswith('#'):
+            analysis_text = '• ' + analysis_text
+
+        return analysis_text
+
+    def _analysis_request(self, df, user_query, results_df):
+        """Build the LLM request that analyzes the query results."""
 
         # Handle empty or None results
         if df is None or df.empty:
@@ -26,18 +80,14 @@ class DataAnalyzer:
                 - Avoid phrases like "it looks like" or "it seems"
             """
             
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a data analyst providing clear, concise responses about query results."},
-                        {"role": "user", "content": empty_result_prompt}
-                    ],
-                    temperature=0
-                )
-                return response.choices[0].message.content.strip()
-            except Exception as e:
-                return "No matching data was found for your query. Please try adjusting your search criteria."
+            return {
+                "model": "gpt-4o-mini",
+                "messages": [
+                    {"role": "system", "content": "You are a data analyst providing clear, concise responses about query results."},
+                    {"role": "user", "content": empty_result_prompt}
+                ],
+                "temperature": 0
+            }
         
         # Prepare data context for non-empty results
         data_summary = {
@@ -45,12 +95,8 @@ class DataAnalyzer:
             'columns': list(df.columns)
         }
         
-        # Format datetime columns
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].astype(str).str[:10]
-
-        data_str = df.head(5).to_string(index=False)
+        # Format datetime columns on the sample only, the result itself is left untouched
+        data_str = format_dates(df.head(5)).to_string(index=False)
         
         prompt = f"""
             Analyze the following data and create a clear, structured report.
@@ -87,51 +133,38 @@ class DataAnalyzer:
 
         """
         
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": """
-                        You are a data analyst. Format your analysis with:
-                        - Markdown formatting
-                        - ## for main sections
-                        - Bold (**) for important metrics
-                        - Hierarchical organization
-                        - Concise paragraphs
-                        Focus on significant findings and critical issues first.
-                        For Generator Fuel Consumption, note that 0.0 is not a malfunction.
-                    """},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0
-            )
-            
-            analysis_text = response.choices[0].message.content.strip()
-            
-            # Ensure consistent formatting
-            if not analysis_text.startswith('•') and not analysis_text.startswith('#'):
-                analysis_text = '• ' + analysis_text
-            
-            return analysis_text
-        except Exception as e:
-            return f"Analysis error: {str(e)}"
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": """
+                    You are a data analyst. Format your analysis with:
+                    - Markdown formatting
+                    - ## for main sections
+                    - Bold (**) for important metrics
+                    - Hierarchical organization
+                    - Concise paragraphs
+                    Focus on significant findings and critical issues first.
+                    For Generator Fuel Consumption, note that 0.0 is not a malfunction.
+                """},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0
+        }
 
-    def build_context_prompt(self, conversation_history):
+    def build_context_prompt(self, conversation_history, session_id=None):
         """
         Convert conversation history into a context string for the model.
         """
-        context_lines = []
+        entries = []
         for entry in conversation_history:
             if 'bot_response' in entry and entry['bot_response']:
-                context_entry = {
+                entries.append({
                     "user_query": entry.get('user_query', ''),
-                    "results": entry['bot_response'].get('results', []),
+                    "generated_sql": entry['bot_response'].get('query'),
                     "analysis": entry['bot_response'].get('analysis', '')
-                }
-                
-                context_lines.append(f"Previous Interaction: {json.dumps(context_entry)}")
+                })
         
         # Limit context to last 5 entries
-        context_lines = context_lines[-5:]
+        entries = entries[-5:]
         
-        return "Conversation Context:\n" + "\n".join(context_lines)
+        return "Conversation Context:\n" + self.context_compactor.compact(entries, session_id=session_id)
@@ -0,0 +1,146 @@
+# answerstore.py
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerStore:
+    def __init__(self, directory=None, max_age_hours=None):
+        """
+        Initialize the materialized store of precomputed known good query answers
+
+        :param directory: Directory the answers are written to
+        :param max_age_hours: Age after which an answer is considered stale
+        """
+        self.directory = directory or os.getenv("ANSWER_STORE_DIR", "answer_store")
+        self.max_age = timedelta(hours=float(max_age_hours or os.getenv("ANSWER_STORE_MAX_AGE_HOURS", "24")))
+        self.index_path = os.path.join(self.directory, "index.json")
+        self._index = {}
+        self._frames = {}
+        self._index_mtime = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def sql_hash(sql):
+        """Return a stable hash of the SQL text."""
+        return hashlib.sha256(sql.strip().encode('utf-8')).hexdigest()
+
+    def _reload(self):
+        """Reload the index if the warm-up job has written a new one."""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading answer store index: {e}")
+            return
+
+        self._index = index
+        self._frames = {}
+        self._index_mtime = mtime
+        logger.info(f"Loaded {len(index)} precomputed answers")
+
+    def is_fresh(self, entry):
+        """Check that an answer was computed today and is within the maximum age."""
+        created_at = datetime.fromisoformat(entry['created_at'])
+        return created_at.date() == datetime.now().date() and datetime.now() - created_at <= self.max_age
+
+    def has_answers(self):
+        """Check whether any precomputed answers are available."""
+        with self._lock:
+            self._reload()
+            return bool(self._index)
+
+    def get(self, sql):
+        """
+        Look up a fresh precomputed answer
+
+        :param sql: SQL of the known good query
+        :return: Dictionary with results DataFrame and analysis, or None if missing or stale
+        """
+        if not sql:
+            return None
+        key = self.sql_hash(sql)
+
+        with self._lock:
+            self._reload()
+            entry = self._index.get(key)
+            if entry is None or not self.is_fresh(entry):
+                return None
+
+            df = self._frames.get(key)
+            if df is None:
+                try:
+                    df = pd.read_parquet(os.path.join(self.directory, entry['file']))
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error reading precomputed answer {key}: {e}")
+                    return None
+                self._frames[key] = df
+
+        return {
+            'results_df': df.copy() if not df.empty else None,
+            'analysis': entry['analysis'],
+            'notices': entry.get('notices', []),
+            'sql': entry['sql'],
+        }
+
+    def save(self, answers, keep=()):
+        """
+        Replace the stored answers with a new warm-up run
+
+        :param answers: List of dictionaries with user_query, sql, results_df, analysis and optional notices
+        :param keep: SQL of queries that failed in this run; their previous answers are kept as they are
+        """
+        with self._lock:
+            self._reload()
+            previous = dict(self._index)
+
+        index = {}
+        for sql in keep:
+            key = self.sql_hash(sql)
+            if key in previous:
+                index[key] = previous[key]
+
+        for answer in answers:
+            key = self.sql_hash(answer['sql'])
+            file_name = f"{key}.parquet"
+            df = answer['results_df']
+            if df is None:
+                df = pd.DataFrame()
+            df.to_parquet(os.path.join(self.directory, file_name), index=False)
+            index[key] = {
+                'user_query': answer['user_query'],
+                'sql': answer['sql'],
+                'analysis': answer['analysis'],
+                'notices': answer.get('notices', []),
+                'request_count': answer.get('request_count', 0),
+                'created_at': datetime.now().isoformat(),
+                'file': file_name,
+            }
+
+        # Write the index atomically so readers never see a partial file
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+        # Remove answers that dropped out of the warm-up set
+        files = {entry['file'] for entry in index.values()}
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet') and name not in files:
+                os.remove(os.path.join(self.directory, name))
+
+        logger.info(f"Saved {len(answers)} precomputed answers, kept {len(index) - len(answers)} previous ones")
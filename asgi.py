@@ -0,0 +1,257 @@
+# asgi.py
+"""
+Async serving mode for the chat service.
+
+Run with an ASGI server, for example:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+Routes match main.py. LLM calls use the async OpenAI client and BigQuery
+jobs are polled without blocking the event loop, so a single process can
+hold many concurrent conversations.
+"""
+import asyncio
+import json
+import secrets
+import uuid
+from quart import Quart, Response, jsonify, request, session, render_template
+from quart_cors import cors
+from chathandler import QueryType
+from history import ConversationHistory
+from admission import AdmissionRejected, Priority, priority_var
+from queryguard import QueryRejectedError
+from sqlvalidator import SQLValidationError
+from init import assign_request_id, request_id_var
+from main import (
+    logger, metadata, query_logger, chat_handler, sql_builder, data_analyzer,
+    admission, result_store, parse_batch_request, build_analysis_response, serve_precomputed, request_priority,
+    rejected_response, invalid_query_response, RESULTS_MAX_PAGE_SIZE, BATCH_MAX_WORKERS
+)
+
+app = Quart(__name__)
+app.config['SECRET_KEY'] = secrets.token_hex(32)
+app = cors(app, allow_origin="*", allow_methods=["GET", "POST"], allow_headers=["Content-Type"])
+
+
+@app.before_request
+async def set_request_id():
+    assign_request_id(request.headers)
+
+
+@app.after_request
+async def add_request_id_header(response):
+    response.headers['X-Request-ID'] = request_id_var.get() or ''
+    return response
+
+
+async def answer_data_query(user_query, query, session_id):
+    """Async variant of main.answer_data_query."""
+    # Batch generation returns the error in place of the SQL
+    if isinstance(query, SQLValidationError):
+        raise query
+    if not query:
+        raise SQLValidationError("No SQL query could be generated for this question.")
+
+    notices = []
+    results_df = await sql_builder.execute_query_async(query, user_query, notices=notices)
+
+    analysis = await data_analyzer.analyze_data_async(
+        results_df,
+        user_query,
+        results_df
+    )
+
+    await asyncio.to_thread(
+        query_logger.log_query,
+        session_id=session_id,
+        user_query=user_query,
+        generated_sql=query,
+        analysis=analysis
+    )
+
+    return await asyncio.to_thread(build_analysis_response, results_df, analysis, query, session_id, notices)
+
+
+async def get_context(session_id):
+    return {
+        'session_id': session_id,
+        'conversation_history': await asyncio.to_thread(query_logger.get_context_history, session_id)
+    }
+
+
+def get_session_id():
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+    return session['session_id']
+
+
+@app.route("/")
+async def home():
+    return await render_template("index.html")
+
+@app.route('/ask', methods=['POST'])
+async def ask():
+    try:
+        data = await request.get_json(force=True)
+        user_query = data.get('message', '')
+
+        logger.info(f"Received query: {user_query}")
+
+        if not user_query:
+            return jsonify({"error": "No message provided"}), 400
+
+        priority_var.set(request_priority(data, Priority.INTERACTIVE))
+        session_id = get_session_id()
+
+        response = await chat_handler.handle_query_async(user_query, session_id)
+
+        if response['type'] == 'data':
+            known_query = await asyncio.to_thread(sql_builder.find_known_query, user_query)
+            precomputed = await asyncio.to_thread(serve_precomputed, user_query, known_query, session_id)
+            if precomputed:
+                return jsonify(precomputed)
+
+            context = await get_context(session_id)
+            query = known_query or await sql_builder.generate_sql_query_async(
+                user_query, metadata, context, match_known=False
+            )
+            return jsonify(await answer_data_query(user_query, query, session_id))
+
+        return jsonify({
+            "type": response['type'],
+            "response": response['response'],
+            "query": None,
+            "results": []
+        })
+
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected by admission control: {e}")
+        return jsonify({"error": str(e)}), 503
+    except QueryRejectedError as e:
+        logger.warning(f"Rejected by query guard: {e}")
+        return jsonify(rejected_response(e)), 422
+    except SQLValidationError as e:
+        logger.warning(f"No valid SQL for query: {e}")
+        return jsonify(invalid_query_response(e)), 422
+    except Exception as e:
+        logger.error(f"Error in ask route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/ask_batch', methods=['POST'])
+async def ask_batch():
+    """Answer a list of questions, streaming one JSON line per item as it finishes."""
+    try:
+        data = await request.get_json(force=True)
+        questions, error = parse_batch_request(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        logger.info(f"Received batch of {len(questions)} queries")
+
+        priority = request_priority(data, Priority.BATCH)
+        priority_var.set(priority)
+        session_id = get_session_id()
+
+        query_types = await chat_handler.determine_query_types_async(questions)
+
+        data_indices = [i for i, t in enumerate(query_types) if t == QueryType.DATA]
+        sql_queries = {}
+        if data_indices:
+            generated = await sql_builder.generate_sql_queries_async(
+                [questions[i] for i in data_indices],
+                metadata,
+                await get_context(session_id),
+                max_concurrency=BATCH_MAX_WORKERS
+            )
+            sql_queries = dict(zip(data_indices, generated))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected by admission control: {e}")
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error in ask_batch route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_WORKERS)
+
+    async def answer(index):
+        user_query = questions[index]
+        # The body may be streamed outside the view's context, set the priority per item
+        priority_var.set(priority)
+        async with semaphore:
+            try:
+                response = await chat_handler.handle_query_async(user_query, session_id, query_types[index])
+                if response['type'] == 'data':
+                    result = await answer_data_query(user_query, sql_queries[index], session_id)
+                else:
+                    result = {
+                        "type": response['type'],
+                        "response": response['response'],
+                        "query": None,
+                        "results": []
+                    }
+            except QueryRejectedError as e:
+                logger.warning(f"Rejected by query guard in ask_batch item {index}: {e}")
+                result = rejected_response(e)
+            except SQLValidationError as e:
+                logger.warning(f"No valid SQL in ask_batch item {index}: {e}")
+                result = invalid_query_response(e)
+            except Exception as e:
+                logger.error(f"Error in ask_batch item {index}: {e}")
+                result = {"type": "error", "error": str(e)}
+        result.update({"index": index, "message": user_query})
+        return result
+
+    async def generate():
+        for task in asyncio.as_completed([answer(i) for i in range(len(questions))]):
+            yield json.dumps(await task, default=str) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/results/<result_id>', methods=['GET'])
+async def get_results(result_id):
+    """Serve a page of a stored result without re-running its query."""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), RESULTS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers"}), 400
+
+    try:
+        result = await asyncio.to_thread(
+            result_store.get_page,
+            result_id,
+            session_id=session.get('session_id'),
+            page=page,
+            page_size=page_size,
+            sort_by=request.args.get('sort'),
+            ascending=request.args.get('order', 'asc').lower() != 'desc'
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if result is None:
+        return jsonify({"error": "Result not found or expired"}), 404
+    return jsonify(result)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Admission queue depth and wait time in Prometheus text format."""
+    return Response(admission.metrics_text(), mimetype='text/plain')
+
+@app.route('/history', methods=['GET'])
+async def get_history():
+    history_manager = ConversationHistory(session)
+    history = history_manager.get_history()
+    return jsonify({
+        "conversation_history": history,
+        "total_entries": len(history)
+    })
+
+@app.route('/clear_history', methods=['POST'])
+async def clear_history():
+    history_manager = ConversationHistory(session)
+    total_cleared = history_manager.clear_history()
+    return jsonify({
+        "status": "History cleared",
+        "total_entries": total_cleared
+    })
@@ -0,0 +1,143 @@
+# benchmark.py
+"""
+Benchmarks for the request hot path that run without cloud services.
+
+    python benchmark.py                 # run every benchmark
+    python benchmark.py result_path     # run one benchmark
+"""
+import re
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from resultframe import normalize_results, format_dates, to_records
+from querynormalizer import normalize_query, normalize_series
+
+
+def measure(func, *args):
+    """Run ``func`` and return (seconds, peak traced memory in MB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+def timed(func, *args):
+    """Run ``func`` and return the seconds taken, without memory tracing overhead."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def make_result_frame(rows, seed=0):
+    """Build a DataFrame shaped like a BigQuery result of site metrics."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'siteid': pd.Series([f"SITE{i % 5000:05d}" for i in range(rows)], dtype=object),
+        'province': pd.Series(rng.choice(['Punjab', 'Sindh', 'KPK', 'Balochistan'], rows), dtype=object),
+        'area': pd.Series(rng.choice([f"Area {i}" for i in range(40)], rows), dtype=object),
+        'time': pd.date_range('2024-01-01', periods=rows, freq='min', tz='UTC'),
+        'run_hours': pd.array(rng.integers(0, 25, rows), dtype='Int64'),
+        'consumption': rng.random(rows).round(2) * 100,
+    })
+
+
+def legacy_result_path(df):
+    """The result handling before normalize_results, kept for comparison."""
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+    df.drop_duplicates(inplace=True)
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype(str).str[:10]
+    df.head(5).to_string(index=False)
+    df.head(3).to_dict(orient='records')
+    return df
+
+
+def result_path(df):
+    """Result handling as done by SQLBuilder.execute_query, DataAnalyzer and /ask."""
+    normalize_results(df)
+    df.drop_duplicates(inplace=True)
+    format_dates(df.head(5)).to_string(index=False)
+    to_records(df.head(3))
+    return df
+
+
+def bench_result_path():
+    print(f"{'rows':>9} {'path':>8} {'seconds':>8} {'peak MB':>8} {'frame MB':>9}")
+    for rows in (10_000, 100_000, 1_000_000):
+        for name, func in (('legacy', legacy_result_path), ('current', result_path)):
+            df = make_result_frame(rows)
+            elapsed, peak = measure(func, df)
+            frame_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+            print(f"{rows:>9} {name:>8} {elapsed:>8.3f} {peak:>8.1f} {frame_mb:>9.1f}")
+
+
+def make_query_corpus(size, seed=0):
+    """Build a Series of known good query texts with company ID suffixes."""
+    rng = np.random.default_rng(seed)
+    verbs = ['Show me', 'List', 'Find', 'Give me', 'Calculate', 'Display', 'Get']
+    metrics = ['the fuel consumption', 'the number of sites', 'run hours', 'battery backup', 'generator availability']
+    scopes = ['for site SITE{:05d}', 'in province {}', 'per area {}', 'for yesterday at site {}']
+    return pd.Series([
+        f"{rng.choice(verbs)} {rng.choice(metrics)} {rng.choice(scopes).format(i)}? | {i % 97}"
+        for i in range(size)
+    ])
+
+
+def legacy_preprocess_query(query):
+    """KnownGoodQueries.preprocess_query before the normalization engine, kept for comparison."""
+    if not query or not isinstance(query, str):
+        return ""
+    query = query.split('|')[0] if '|' in query else query
+    query = query.lower().strip()
+    stopwords = ['calculate', 'the', 'number', 'of', 'find', 'show',
+                 'display', 'get', 'me', 'give', 'list']
+    pattern = '|'.join(r'\b{}\b'.format(word) for word in stopwords)
+    query = re.sub(pattern, '', query, flags=re.IGNORECASE)
+    query = re.sub(r'[^\w\s]', '', query)
+    query = re.sub(r'\s+', ' ', query)
+    return query.strip()
+
+
+def bench_kgq_normalization():
+    print(f"{'queries':>8} {'legacy load':>12} {'vectorized':>11} {'append 1%':>10} {'legacy lookup':>14} {'index lookup':>13}")
+    for size in (1_000, 10_000, 100_000):
+        corpus = make_query_corpus(size)
+        new_rows = make_query_corpus(max(size // 100, 1), seed=1)
+        user_query = corpus.iloc[size // 2]
+
+        legacy_load = timed(lambda: corpus.str.lower().apply(legacy_preprocess_query))
+        vectorized = timed(normalize_series, corpus)
+        normalized = normalize_series(corpus)
+        assert normalized.tolist() == corpus.str.lower().apply(legacy_preprocess_query).tolist()
+        append = timed(normalize_series, new_rows)
+
+        # Per-lookup cost: the legacy path re-normalized the corpus on every exact match
+        legacy_lookup = timed(
+            lambda: corpus.str.lower().apply(legacy_preprocess_query) == legacy_preprocess_query(user_query)
+        )
+        exact_index = dict(zip(normalized, range(size)))
+        index_lookup = timed(lambda: exact_index.get(normalize_query(user_query)))
+
+        print(f"{size:>8} {legacy_load:>11.3f}s {vectorized:>10.3f}s {append:>9.4f}s "
+              f"{legacy_lookup:>13.3f}s {index_lookup:>12.6f}s")
+
+
+BENCHMARKS = {
+    'result_path': bench_result_path,
+    'kgq_normalization': bench_kgq_normalization,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"\n== {name} ==")
+        BENCHMARKS[name]()
@@ -1,18 +1,39 @@
 # buildsql.py
 import re
+import asyncio
 import json
 import ast
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from kgq import KnownGoodQueries
-import pandas as pd
+from queryguard import QueryGuard, QueryRejectedError
+from sqlvalidator import SQLValidator, SQLValidationError, FailedQueryCache
+from contextcompactor import ContextCompactor
+from modelrouter import ModelRouter
+from admission import AdmissionController, AdmissionRejected
+from dimensioncache import DimensionCache
+from resultframe import normalize_results
+from google.api_core.exceptions import BadRequest
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 class SQLBuilder:
-    def __init__(self, bigquery_client, openai_client):
+    # Seconds between BigQuery job status checks in the async path
+    POLL_INTERVAL = 0.25
+
+    def __init__(self, bigquery_client, openai_client, async_openai_client=None, model_router=None, admission=None):
         self.bigquery_client = bigquery_client
         self.client = openai_client
+        self.async_client = async_openai_client
+        self.router = model_router or ModelRouter()
+        self.admission = admission or AdmissionController()
         self.kgq = KnownGoodQueries()
+        self.guard = QueryGuard(bigquery_client)
+        self.dimensions = DimensionCache(bigquery_client)
+        self.failed_queries = FailedQueryCache()
+        self.context_compactor = ContextCompactor()
+        self.validator = None
         self.metadata = None
 
 
@@ -45,28 +66,130 @@ class SQLBuilder:
         else:
             raise ValueError("No SQL code found in the response")
 
-    def execute_query(self, query):
-        """Execute a BigQuery SQL query with intelligent column renaming."""
+    def execute_query(self, query, user_query=None, raise_errors=False, notices=None):
+        """
+        Execute a BigQuery SQL query with intelligent column renaming
+
+        :param query: SQL to execute
+        :param user_query: The user's question, used to add requested dimension columns
+        :param raise_errors: Raise on failure instead of returning None, so callers can tell errors from empty results
+        :param notices: Optional list that receives user-facing notices, e.g. when a date filter was added
+        :return: Result DataFrame, or None if the result is empty or the query failed
+        :raises QueryRejectedError: If the query would process more bytes than allowed
+        :raises SQLValidationError: If the query is known to fail
+        """
         if not query or not isinstance(query, str):
-            logging.error("Invalid query provided. Query must be a non-empty string.")
+            logger.error("Invalid query provided. Query must be a non-empty string.")
             return None
 
+        failure = self.failed_queries.get(query)
+        if failure:
+            logger.warning(f"Skipping query that already failed: {failure}")
+            raise SQLValidationError(failure)
+
         try:
+            self.admission.acquire('bigquery')
+
+            # Dry-run the query and enforce the byte limit before executing
+            guarded_query, estimated_bytes, guard_notices = self.guard.check(query)
+            if notices is not None:
+                notices.extend(guard_notices)
+
             # Execute query and get DataFrame
-            df = self.bigquery_client.query(query).to_dataframe()
+            job = self.bigquery_client.query(guarded_query, job_config=self.guard.job_config())
+            df = job.to_dataframe()
+            self.guard.record(guarded_query, estimated_bytes, job)
             
             if df.empty:
-                logging.warning("Query returned an empty DataFrame.")
+                logger.warning("Query returned an empty DataFrame.")
+                return None
+
+            self._prepare_results(df, user_query)
+
+            # Generate column rename mapping using OpenAI
+            response = self.router.complete(self.client, self._column_rename_request(df.columns), 'column_rename')
+            return self._apply_column_renames(df, response)
+
+        except BadRequest as e:
+            logger.error(f"Error executing query: {e}")
+            # Resource limits and transient 400s may pass next time, only remember deterministic errors
+            if self.failed_queries.is_deterministic(e):
+                self.failed_queries.add(query, e)
+            if raise_errors:
+                raise
+            return None
+        except (AdmissionRejected, QueryRejectedError):
+            raise
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
+            if raise_errors:
+                raise
+            return None
+
+    async def execute_query_async(self, query, user_query=None, raise_errors=False, notices=None):
+        """Async variant of execute_query that polls the BigQuery job without blocking."""
+        if not query or not isinstance(query, str):
+            logger.error("Invalid query provided. Query must be a non-empty string.")
+            return None
+
+        failure = self.failed_queries.get(query)
+        if failure:
+            logger.warning(f"Skipping query that already failed: {failure}")
+            raise SQLValidationError(failure)
+
+        try:
+            await self.admission.acquire_async('bigquery')
+            guarded_query, estimated_bytes, guard_notices = await asyncio.to_thread(self.guard.check, query)
+            if notices is not None:
+                notices.extend(guard_notices)
+
+            # Submit the job, then poll it instead of waiting on its result
+            job = await asyncio.to_thread(
+                self.bigquery_client.query, guarded_query, job_config=self.guard.job_config()
+            )
+            while not await asyncio.to_thread(job.done):
+                await asyncio.sleep(self.POLL_INTERVAL)
+            df = await asyncio.to_thread(job.to_dataframe)
+            self.guard.record(guarded_query, estimated_bytes, job)
+
+            if df.empty:
+                logger.warning("Query returned an empty DataFrame.")
                 return None
 
-            # Convert datetime columns to simple date strings
-            for col in df.columns:
-                if pd.api.types.is_datetime64_any_dtype(df[col]):
-                    df[col] = df[col].dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+            self._prepare_results(df, user_query)
+
+            response = await self.router.complete_async(
+                self.async_client, self._column_rename_request(df.columns), 'column_rename'
+            )
+            return self._apply_column_renames(df, response)
+
+        except BadRequest as e:
+            logger.error(f"Error executing query: {e}")
+            # Resource limits and transient 400s may pass next time, only remember deterministic errors
+            if self.failed_queries.is_deterministic(e):
+                self.failed_queries.add(query, e)
+            if raise_errors:
+                raise
+            return None
+        except (AdmissionRejected, QueryRejectedError):
+            raise
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
+            if raise_errors:
+                raise
+            return None
+
+    def _prepare_results(self, df, user_query=None):
+        """Shrink the result in place and add dimension columns the user asked for."""
+        # Dates stay datetime64 until serialization
+        normalize_results(df)
+        self.dimensions.enrich(df, self.dimensions.requested_columns(user_query))
 
-            # Prepare prompt for column renaming
-            column_prompt = f"""
-            Here are the original database columns: {list(df.columns)}
+    @staticmethod
+    def _column_rename_request(columns):
+        """Build the LLM request that maps database columns to display names."""
+        column_prompt = f"""
+            Here are the original database columns: {list(columns)}
 
             Rename them professionally with the following rules:
             - Proper capitalization
@@ -81,43 +204,54 @@ class SQLBuilder:
             Return only a **valid Python dictionary**        
              """
 
+        return {
+            "model": "gpt-3.5-turbo-0125",
+            "messages": [
+                {"role": "system", "content": "You are a SQL expert. Respond only with the requested Python dictionary."},
+                {"role": "user", "content": column_prompt}
+            ],
+            "temperature": 0
+        }
 
-            # Generate column rename mapping using OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=[
-                    {"role": "system", "content": "You are a SQL expert. Respond only with the requested Python dictionary."},
-                    {"role": "user", "content": column_prompt}
-                ],
-                temperature=0
-            )
-            
-            rename_text = response.choices[0].message.content.strip()
+    @staticmethod
+    def _apply_column_renames(df, response):
+        """Rename columns using the LLM rename mapping and drop duplicate rows."""
+        rename_text = response.choices[0].message.content.strip()
 
-            try:
-                # Remove code block markers and parse the response
-                rename_text = re.sub(r'^```python\n', '', rename_text)
-                rename_text = re.sub(r'\n```$', '', rename_text)
-                column_rename_map = ast.literal_eval(rename_text)
+        try:
+            # Remove code block markers and parse the response
+            rename_text = re.sub(r'^```python\n', '', rename_text)
+            rename_text = re.sub(r'\n```$', '', rename_text)
+            column_rename_map = ast.literal_eval(rename_text)
 
-                if not isinstance(column_rename_map, dict):
-                    raise ValueError("Generated rename map is not a dictionary.")
+            if not isinstance(column_rename_map, dict):
+                raise ValueError("Generated rename map is not a dictionary.")
 
-                # Rename columns
-                df.rename(columns=column_rename_map, inplace=True)
-                logging.info(f"Columns renamed successfully: {column_rename_map}")
+            # Rename columns
+            df.rename(columns=column_rename_map, inplace=True)
+            logger.info(f"Columns renamed successfully: {column_rename_map}")
 
-            except (SyntaxError, ValueError, TypeError) as parse_error:
-                logging.error(f"Error parsing column rename map: {parse_error}")
-                logging.warning("Returning DataFrame with original column names.")
+        except (SyntaxError, ValueError, TypeError) as parse_error:
+            logger.error(f"Error parsing column rename map: {parse_error}")
+            logger.warning("Returning DataFrame with original column names.")
 
-            # Eliminate duplicate rows if applicable
-            df.drop_duplicates(inplace=True)
-            return df
+        # Eliminate duplicate rows if applicable
+        df.drop_duplicates(inplace=True)
+        return df
 
-        except Exception as e:
-            logging.error(f"Error executing query: {e}")
-            return None
+    def _context_str(self, context):
+        """Compact the conversation history for the SQL prompt."""
+        if context and 'conversation_history' in context:
+            # History is returned newest first, the compactor expects oldest first
+            return self.context_compactor.compact(
+                list(reversed(context['conversation_history'])),
+                session_id=context.get('session_id')
+            )
+        return "No previous context"
+
+    def _score(self, user_query, context=None):
+        """Complexity score of a SQL generation request, for model routing."""
+        return self.router.score_complexity(user_query, len(self._context_str(context)))
 
     def generate_sql_prompt(self, user_query, metadata, context=None):
         """Generate an advanced SQL query prompt."""
@@ -125,16 +259,16 @@ class SQLBuilder:
         
         metadata_str = json.dumps(metadata, indent=2) if metadata else "No metadata available"
 
-        if context and 'conversation_history' in context:
-            context_list = []
-            for entry in context['conversation_history']:
-                context_list.append({
-                    'sql': entry['generated_sql'],
-                    'analysis': entry['analysis']
-                })
-            context_str = json.dumps(context_list, indent=2)
+        context_str = self._context_str(context)
+
+        resolved_sites = self.dimensions.resolve_sites(user_query)
+        if resolved_sites:
+            resolved_str = "; ".join(
+                f"siteid {site['siteid']} ({site.get('sitename')}, companyId {site.get('companyId')})"
+                for site in resolved_sites
+            )
         else:
-            context_str = "No previous context"
+            resolved_str = "None"
 
         prompt = f"""
             ## SQL Query Generation Guidelines:
@@ -143,6 +277,7 @@ class SQLBuilder:
             - **User Request:** {user_query}
             - **Metadata (Table & Column Descriptions):** {metadata}
             - **Conversation Context:** {context_str}
+            - **Resolved Sites:** {resolved_str}
 
             ### **2. Key SQL Generation Rules:**
             - Use **only the provided metadata** for column names. Do not hallucinate any columns.
@@ -161,8 +296,10 @@ class SQLBuilder:
             - Access dates as: `DATE(time) = 'YYYY-MM-DD'` the year will not be earlier than 2024.
 
             - Use 'edgepointprod.Axin_Data.siteinfra' for details regarding infrastructure of the sites like counts, models, availability status, province, area. 
+            - Do not join siteinfra only to display province, area or model next to a siteid; these columns are added to the results after the query. Join it only to filter or group by them.
 
             - Use `edgepointprod.Axin_Data.site` only for matching companyId with siteId. No other columns are necessary.
+            - If **Resolved Sites** are listed, filter on those siteid values as well; they belong to the user's company, so keep the companyId filter through `edgepointprod.Axin_Data.site` as usual.
 
             - If the query involves **run hours**, use `edgepointprod.Axin_Data.performancedaily`.
             - Run hours range from **0 to 24 per day**.
@@ -194,46 +331,272 @@ class SQLBuilder:
 
         return prompt
 
-    def generate_sql_query(self, user_query, metadata, context=None):
-        """Generate SQL query using known good queries or OpenAI."""
+    def generate_sql_query(self, user_query, metadata, context=None, match_known=True):
+        """
+        Generate SQL query using known good queries or OpenAI
+
+        :param match_known: Look up known good queries first; pass False if the caller already did
+        """
         
         self.metadata = metadata
         if not self.metadata:
-            logging.info("No metadata")
+            logger.info("No metadata")
+            return None
+
+        if match_known:
+            known_query = self.find_known_query(user_query)
+            if known_query:
+                return known_query
+
+        # If no matches found, generate new query
+        return self._generate_sql_with_llm(user_query, context)
+
+    async def generate_sql_query_async(self, user_query, metadata, context=None, match_known=True):
+        """Async variant of generate_sql_query."""
+        self.metadata = metadata
+        if not self.metadata:
+            logger.info("No metadata")
             return None
 
+        if match_known:
+            # Matching is CPU-bound (embedding), keep it off the event loop
+            known_query = await asyncio.to_thread(self.find_known_query, user_query)
+            if known_query:
+                return known_query
+
+        return await self._generate_sql_with_llm_async(user_query, context)
+
+    def find_known_query(self, user_query):
+        """Return the SQL of an exact or similar known good query, if any."""
         # Try to find exact match first
         exact_match = self.kgq.find_exact_match(user_query)
         if exact_match:
-            logging.info("✅Test Passed: Found exact matching query")
+            logger.info("✅Test Passed: Found exact matching query")
             return exact_match
 
         # Try to find similar match
         similar_match = self.kgq.find_similar_match(user_query)
         if similar_match:
-            logging.info("✅Test Passed: Found similar matching query")
+            logger.info("✅Test Passed: Found similar matching query")
             return similar_match
 
-        # If no matches found, generate new query
+        return None
+
+    def generate_sql_queries(self, user_queries, metadata, context=None, max_workers=4):
+        """Generate SQL for a batch of queries.
+
+        Known good queries are matched for the whole batch at once and only
+        the queries still missing SQL are sent to OpenAI, concurrently.
+        Returns a list aligned with ``user_queries``; a question for which no
+        valid SQL could be built holds its SQLValidationError instead.
+        """
+        self.metadata = metadata
+        if not self.metadata:
+            logger.info("No metadata")
+            return [None] * len(user_queries)
+
+        queries = self.kgq.find_matches_batch(user_queries)
+        missing = [idx for idx, query in enumerate(queries) if not query]
+        logger.info(f"✅Known good queries matched {len(queries) - len(missing)} of {len(queries)}")
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Copy the context so workers keep the request's priority and ID
+                generated = executor.map(
+                    lambda idx: contextvars.copy_context().run(
+                        self._generate_sql_or_error, user_queries[idx], context
+                    ),
+                    missing
+                )
+                for idx, query in zip(missing, generated):
+                    queries[idx] = query
+
+        return queries
+
+    async def generate_sql_queries_async(self, user_queries, metadata, context=None, max_concurrency=4):
+        """Async variant of generate_sql_queries."""
+        self.metadata = metadata
+        if not self.metadata:
+            logger.info("No metadata")
+            return [None] * len(user_queries)
+
+        queries = await asyncio.to_thread(self.kgq.find_matches_batch, user_queries)
+        missing = [idx for idx, query in enumerate(queries) if not query]
+        logger.info(f"✅Known good queries matched {len(queries) - len(missing)} of {len(queries)}")
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate(idx):
+            async with semaphore:
+                try:
+                    return await self._generate_sql_with_llm_async(user_queries[idx], context)
+                except SQLValidationError as e:
+                    return e
+
+        generated = await asyncio.gather(*(generate(idx) for idx in missing))
+        for idx, query in zip(missing, generated):
+            queries[idx] = query
+
+        return queries
+
+    def _sql_generation_request(self, user_query, context=None):
+        """Build the LLM request that generates SQL for ``user_query``."""
+        prompt = self.generate_sql_prompt(user_query, self.metadata, context)
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "You are a SQL expert. Generate SQL queries based on user requirements."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0
+        }
+
+    def _generate_sql_or_error(self, user_query, context=None):
+        """Generate SQL for one batch item, returning the SQLValidationError so it fails only that item."""
         try:
-            prompt = self.generate_sql_prompt(user_query, self.metadata, context)
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a SQL expert. Generate SQL queries based on user requirements."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0
+            return self._generate_sql_with_llm(user_query, context)
+        except SQLValidationError as e:
+            return e
+
+    def _generate_sql_with_llm(self, user_query, context=None):
+        """Generate a new SQL query for ``user_query`` using OpenAI."""
+        try:
+            response = self.router.complete(
+                self.client,
+                self._sql_generation_request(user_query, context),
+                'sql_generation',
+                self._score(user_query, context)
             )
             
             # Extract and print the generated response (including the SQL and explanation)
             #generated_response = response.choices[0].message.content.strip()
-            #logging.info(f"SQL Query and Explanation:\n{generated_response}")
+            #logger.info(f"SQL Query and Explanation:\n{generated_response}")
             query = self.extract_sql(response.choices[0].message.content)
-            logging.info("✅ Generated new query using OpenAI")
+            logger.info("✅ Generated new query using OpenAI")
+
+            return self.validate_sql(query)
+        except (AdmissionRejected, SQLValidationError):
+            raise
+        except Exception as e:
+            logger.error(f"Error generating SQL query: {e}")
+            return None
+
+    async def _generate_sql_with_llm_async(self, user_query, context=None):
+        """Async variant of _generate_sql_with_llm."""
+        try:
+            response = await self.router.complete_async(
+                self.async_client,
+                self._sql_generation_request(user_query, context),
+                'sql_generation',
+                self._score(user_query, context)
+            )
+            query = self.extract_sql(response.choices[0].message.content)
+            logger.info("✅ Generated new query using OpenAI")
+
+            return await self.validate_sql_async(query)
+        except (AdmissionRejected, SQLValidationError):
+            raise
+        except Exception as e:
+            logger.error(f"Error generating SQL query: {e}")
+            return None
+
+    def _validation_errors(self, query):
+        """Validate ``query`` against the current metadata and remember failures."""
+        if self.validator is None or self.validator.metadata is not self.metadata:
+            self.validator = SQLValidator(self.metadata)
+
+        errors = self.validator.validate(query)
+        if errors:
+            self.failed_queries.add(query, "; ".join(errors))
+        return errors
+
+    def _accept_repair(self, repaired, errors):
+        """
+        Return the repaired SQL if it passes validation
+
+        :raises SQLValidationError: With the remaining errors if the repair failed or did not validate
+        """
+        if not repaired:
+            raise SQLValidationError(errors)
+
+        repair_errors = self._validation_errors(repaired)
+        if repair_errors:
+            logger.error(f"Repaired SQL still failed validation: {repair_errors}")
+            raise SQLValidationError(repair_errors)
+
+        logger.info("✅ Repaired SQL passed validation")
+        return repaired
+
+    def validate_sql(self, query):
+        """
+        Validate generated SQL locally, with one LLM repair attempt on failure
 
+        :raises SQLValidationError: If neither the query nor its repair is valid
+        """
+        errors = self._validation_errors(query)
+        if not errors:
+            return query
+
+        logger.warning(f"Generated SQL failed validation: {errors}")
+        return self._accept_repair(self.repair_sql(query, errors), errors)
+
+    async def validate_sql_async(self, query):
+        """Async variant of validate_sql."""
+        errors = self._validation_errors(query)
+        if not errors:
             return query
+
+        logger.warning(f"Generated SQL failed validation: {errors}")
+        return self._accept_repair(await self.repair_sql_async(query, errors), errors)
+
+    def _repair_request(self, query, errors):
+        """Build the LLM request that fixes ``query`` given its validation errors."""
+        error_list = "\n".join(f"- {error}" for error in errors)
+        prompt = f"""
+            The following BigQuery SQL failed validation:
+
+            ```sql
+            {query}
+            ```
+
+            Validation errors:
+            {error_list}
+
+            Fix only these errors. Use only tables and columns from this metadata:
+            {self.metadata}
+
+            Return the corrected query in a ```sql code block.
+        """
+
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "You are a SQL expert. Fix BigQuery SQL queries."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0
+        }
+
+    def repair_sql(self, query, errors):
+        """Ask OpenAI to fix ``query`` given the exact validation errors."""
+        try:
+            response = self.router.complete(self.client, self._repair_request(query, errors), 'sql_repair')
+            return self.extract_sql(response.choices[0].message.content)
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error repairing SQL query: {e}")
+            return None
+
+    async def repair_sql_async(self, query, errors):
+        """Async variant of repair_sql."""
+        try:
+            response = await self.router.complete_async(
+                self.async_client, self._repair_request(query, errors), 'sql_repair'
+            )
+            return self.extract_sql(response.choices[0].message.content)
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            logging.error(f"Error generating SQL query: {e}")
+            logger.error(f"Error repairing SQL query: {e}")
             return None
@@ -1,6 +1,14 @@
+import asyncio
+import json
+import logging
+import re
 from datetime import datetime
 from enum import Enum
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from modelrouter import ModelRouter
+from admission import AdmissionRejected
+
+logger = logging.getLogger(__name__)
 
 class QueryType(Enum):
     CHAT = "CHAT"
@@ -9,12 +17,18 @@ class QueryType(Enum):
     OUT_OF_SCOPE = "OUT_OF_SCOPE"
 
 class ChatHandler:
-    def __init__(self, openai_client, query_logger):
+    CHAT_ERROR = "I apologize, but I encountered an error processing your request."
+    DEFINITION_ERROR = "I apologize, but I encountered an error explaining this term."
+
+    def __init__(self, openai_client, query_logger, async_openai_client=None, model_router=None):
         self.client = openai_client
+        self.async_client = async_openai_client
+        self.router = model_router or ModelRouter()
         self.query_logger = query_logger
 
-    def determine_query_type(self, query: str) -> QueryType:
-        """Determine the type of query using LLM classification."""
+    @staticmethod
+    def _classification_request(query: str) -> Dict[str, Any]:
+        """Build the LLM request that classifies a single query."""
         messages = [
             {"role": "system", "content": """
             Classify the query into one of these categories:
@@ -27,25 +41,111 @@ class ChatHandler:
             """},
             {"role": "user", "content": f'"{query}"'}
         ]
-        
+        return {"model": "gpt-3.5-turbo-0125", "messages": messages, "max_tokens": 10}
+
+    def determine_query_type(self, query: str) -> QueryType:
+        """Determine the type of query using LLM classification."""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=messages,
-                max_tokens=10
-            )
+            response = self.router.complete(self.client, self._classification_request(query), 'classification')
             result = response.choices[0].message.content.strip().upper()
             return QueryType(result)
         except ValueError:
             # If the response doesn't match any QueryType, default to OUT_OF_SCOPE
             return QueryType.OUT_OF_SCOPE
+        except AdmissionRejected:
+            raise
         except Exception as e:
-            print(f"Error in determine_query_type: {e}")
+            logger.error(f"Error in determine_query_type: {e}")
             return QueryType.OUT_OF_SCOPE
 
-    def handle_query(self, query: str, session_id: str) -> Dict[str, Any]:
+    async def determine_query_type_async(self, query: str) -> QueryType:
+        """Async variant of determine_query_type."""
+        try:
+            response = await self.router.complete_async(self.async_client, self._classification_request(query), 'classification')
+            result = response.choices[0].message.content.strip().upper()
+            return QueryType(result)
+        except ValueError:
+            return QueryType.OUT_OF_SCOPE
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error in determine_query_type_async: {e}")
+            return QueryType.OUT_OF_SCOPE
+
+    @staticmethod
+    def _batch_classification_request(queries: List[str]) -> Dict[str, Any]:
+        """Build the LLM request that classifies a numbered list of queries."""
+        numbered = "\n".join(f"{i + 1}. {query}" for i, query in enumerate(queries))
+        messages = [
+            {"role": "system", "content": """
+            Classify each numbered query into one of these categories:
+            - CHAT: General conversation, greetings, or small talk
+            - DATA: Queries about site metrics, performance, or comparisons
+            - DEFINITION: Requests for definitions or explanations of technical terms
+            - OUT_OF_SCOPE: Questions about unrelated topics (politics, general knowledge, etc.)
+            
+            Respond with only a JSON array of category names, one per query, in order.
+            """},
+            {"role": "user", "content": numbered}
+        ]
+        return {"model": "gpt-3.5-turbo-0125", "messages": messages, "max_tokens": 10 * len(queries) + 10}
+
+    @staticmethod
+    def _parse_query_types(response, count: int) -> List[QueryType]:
+        """Parse a batched classification response into one QueryType per query."""
+        result = response.choices[0].message.content.strip()
+        result = re.sub(r'^```(?:json)?\n|\n```$', '', result)
+        labels = json.loads(result)
+        if not isinstance(labels, list) or len(labels) != count:
+            raise ValueError("Batch classification does not match the number of queries")
+
+        query_types = []
+        for label in labels:
+            try:
+                query_types.append(QueryType(str(label).strip().upper()))
+            except ValueError:
+                query_types.append(QueryType.OUT_OF_SCOPE)
+        return query_types
+
+    def determine_query_types(self, queries: List[str]) -> List[QueryType]:
+        """Classify a list of queries with a single LLM call.
+
+        Falls back to classifying each query individually if the batched
+        response cannot be parsed or does not line up with the input.
+        """
+        if not queries:
+            return []
+
+        try:
+            response = self.router.complete(self.client, self._batch_classification_request(queries), 'classification')
+            return self._parse_query_types(response, len(queries))
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.warning(f"Error in determine_query_types, classifying individually: {e}")
+            return [self.determine_query_type(query) for query in queries]
+
+    async def determine_query_types_async(self, queries: List[str]) -> List[QueryType]:
+        """Async variant of determine_query_types."""
+        if not queries:
+            return []
+
+        try:
+            response = await self.router.complete_async(
+                self.async_client, self._batch_classification_request(queries), 'classification'
+            )
+            return self._parse_query_types(response, len(queries))
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.warning(f"Error in determine_query_types_async, classifying individually: {e}")
+            return list(await asyncio.gather(*(self.determine_query_type_async(query) for query in queries)))
+
+    def handle_query(self, query: str, session_id: str,
+                     query_type: Optional[QueryType] = None) -> Dict[str, Any]:
         """Handle all types of queries based on their classification."""
-        query_type = self.determine_query_type(query)
+        if query_type is None:
+            query_type = self.determine_query_type(query)
         
         handlers = {
             QueryType.CHAT: self._handle_chat,
@@ -66,8 +166,72 @@ class ChatHandler:
         
         return response
 
-    def _handle_chat(self, query: str, session_id: str) -> Dict[str, Any]:
-        """Handle conversational queries."""
+    async def handle_query_async(self, query: str, session_id: str,
+                                 query_type: Optional[QueryType] = None) -> Dict[str, Any]:
+        """Async variant of handle_query."""
+        if query_type is None:
+            query_type = await self.determine_query_type_async(query)
+
+        if query_type == QueryType.CHAT:
+            response = await self._generate_response_async(
+                self._chat_request(query), "chat", "conversation", self.CHAT_ERROR
+            )
+        elif query_type == QueryType.DEFINITION:
+            response = await self._generate_response_async(
+                self._definition_request(query), "definition", "definition", self.DEFINITION_ERROR
+            )
+        elif query_type == QueryType.DATA:
+            response = self._handle_data(query, session_id)
+        else:
+            response = self._handle_out_of_scope(query, session_id)
+
+        # Log the interaction without blocking the event loop
+        await asyncio.to_thread(
+            self.query_logger.log_query,
+            session_id=session_id,
+            user_query=query,
+            analysis=response.get('response', '')
+        )
+
+        return response
+
+    def _generate_response(self, request: Dict[str, Any], task: str, response_type: str, error_message: str) -> Dict[str, Any]:
+        """Run an LLM request and wrap the reply in a response dictionary."""
+        try:
+            response = self.router.complete(self.client, request, task)
+            return {
+                "type": response_type,
+                "response": response.choices[0].message.content.strip()
+            }
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating {response_type} response: {e}")
+            return {
+                "type": "error",
+                "response": error_message
+            }
+
+    async def _generate_response_async(self, request: Dict[str, Any], task: str, response_type: str, error_message: str) -> Dict[str, Any]:
+        """Async variant of _generate_response."""
+        try:
+            response = await self.router.complete_async(self.async_client, request, task)
+            return {
+                "type": response_type,
+                "response": response.choices[0].message.content.strip()
+            }
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating {response_type} response: {e}")
+            return {
+                "type": "error",
+                "response": error_message
+            }
+
+    @staticmethod
+    def _chat_request(query: str) -> Dict[str, Any]:
+        """Build the LLM request for a conversational query."""
         messages = [
             {"role": "system", "content": 
                 f"You are AxInBot, an AI assistant for EdgePoint's telecommunications infrastructure. "
@@ -78,26 +242,11 @@ class ChatHandler:
             },
             {"role": "user", "content": query}
         ]
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=messages,
-                max_tokens=100
-            )
-            return {
-                "type": "conversation",
-                "response": response.choices[0].message.content.strip()
-            }
-        except Exception as e:
-            print(f"Error in _handle_chat: {e}")
-            return {
-                "type": "error",
-                "response": "I apologize, but I encountered an error processing your request."
-            }
+        return {"model": "gpt-3.5-turbo-0125", "messages": messages, "max_tokens": 100}
 
-    def _handle_definition(self, query: str, session_id: str) -> Dict[str, Any]:
-        """Handle definition/explanation queries."""
+    @staticmethod
+    def _definition_request(query: str) -> Dict[str, Any]:
+        """Build the LLM request for a definition query."""
         messages = [
             {"role": "system", "content": 
                 "You are a technical expert in telecommunications infrastructure. "
@@ -106,23 +255,15 @@ class ChatHandler:
             },
             {"role": "user", "content": query}
         ]
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                messages=messages,
-                max_tokens=100
-            )
-            return {
-                "type": "definition",
-                "response": response.choices[0].message.content.strip()
-            }
-        except Exception as e:
-            print(f"Error in _handle_definition: {e}")
-            return {
-                "type": "error",
-                "response": "I apologize, but I encountered an error explaining this term."
-            }
+        return {"model": "gpt-3.5-turbo-0125", "messages": messages, "max_tokens": 100}
+
+    def _handle_chat(self, query: str, session_id: str) -> Dict[str, Any]:
+        """Handle conversational queries."""
+        return self._generate_response(self._chat_request(query), "chat", "conversation", self.CHAT_ERROR)
+
+    def _handle_definition(self, query: str, session_id: str) -> Dict[str, Any]:
+        """Handle definition/explanation queries."""
+        return self._generate_response(self._definition_request(query), "definition", "definition", self.DEFINITION_ERROR)
 
     def _handle_data(self, query: str, session_id: str) -> Dict[str, Any]:
         """Handle data analysis queries - return None to let main app handle it."""
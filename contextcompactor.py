@@ -0,0 +1,150 @@
+# contextcompactor.py
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Minimum characters of a question worth keeping next to the SQL
+MIN_QUESTION_CHARS = 40
+SQL_OMITTED = "SQL: (omitted, too long for the context budget)"
+
+
+class ContextCompactor:
+    def __init__(self, token_budget=None, summary_chars=160, cache_size=1024):
+        """
+        Initialize the compactor that fits conversation history into a token budget
+
+        :param token_budget: Maximum tokens of context per prompt, defaults to CONTEXT_TOKEN_BUDGET
+        :param summary_chars: Maximum length of the summary kept for an older turn
+        :param cache_size: Number of summaries and compacted contexts kept in memory
+        """
+        self.token_budget = int(token_budget or os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+        self.summary_chars = summary_chars
+        self.cache_size = cache_size
+        self._summaries = OrderedDict()
+        self._compacted = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token count, about four characters per token for English and SQL."""
+        return (len(text) + 3) // 4 if text else 0
+
+    @staticmethod
+    def _hash(*parts):
+        return hashlib.sha256("\x1f".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def normalize_sql(sql):
+        """Normalize SQL whitespace and case so repeated queries compare equal."""
+        return re.sub(r'\s+', ' ', sql or '').strip().lower()
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def summarize(self, text):
+        """Reduce an analysis to its first sentence, without markdown, cached by content."""
+        if not text:
+            return ""
+        key = self._hash(text)
+        with self._lock:
+            if key in self._summaries:
+                return self._summaries[key]
+
+        plain = re.sub(r'[#*_`>]+', '', str(text))
+        plain = re.sub(r'^\s*[-•]\s*', '', plain, flags=re.MULTILINE)
+        plain = re.sub(r'\s+', ' ', plain).strip()
+        summary = re.split(r'(?<=[.!?])\s', plain, maxsplit=1)[0]
+        if len(summary) > self.summary_chars:
+            summary = summary[:self.summary_chars].rsplit(' ', 1)[0] + '…'
+
+        self._remember(self._summaries, key, summary)
+        return summary
+
+    @staticmethod
+    def _shorten(text, chars):
+        """Shorten prose to ``chars`` characters at a word boundary."""
+        if len(text) <= chars:
+            return text
+        return text[:max(chars - 1, 0)].rsplit(' ', 1)[0] + '…'
+
+    def _fit_latest(self, user_query, sql=None):
+        """
+        Fit the newest turn into the budget on its own
+
+        The answer summary is dropped and the question shortened first. SQL is
+        never cut mid-statement: if it does not fit it is left out with a marker.
+        """
+        chars = self.token_budget * 4
+        if not sql:
+            return "Q: " + self._shorten(user_query, chars - 3)
+
+        sql_part = f"\nSQL:\n{sql.strip()}"
+        room = chars - 3 - len(sql_part)
+        if room >= min(len(user_query), MIN_QUESTION_CHARS):
+            return "Q: " + self._shorten(user_query, room) + sql_part
+        return "Q: " + self._shorten(user_query, chars - 4 - len(SQL_OMITTED)) + "\n" + SQL_OMITTED
+
+    def compact(self, history, session_id=None):
+        """
+        Compact conversation history into a context string within the token budget
+
+        The most recent SQL is kept verbatim, older turns are reduced to
+        summaries and SQL repeated across turns is only included once.
+
+        :param history: Entries with user_query, generated_sql and analysis, oldest first
+        :param session_id: Session the history belongs to, used for memoization
+        :return: Context string
+        """
+        if not history:
+            return "No previous context"
+
+        key = self._hash(session_id, self.token_budget, *(
+            (entry.get('user_query'), entry.get('generated_sql'), entry.get('analysis'))
+            for entry in history
+        ))
+        with self._lock:
+            if key in self._compacted:
+                self._compacted.move_to_end(key)
+                return self._compacted[key]
+
+        lines = []
+        seen_sql = set()
+        used = 0
+        sql_kept = False
+
+        # Walk from the newest turn backwards so recent turns win the budget
+        for entry in reversed(history):
+            user_query = entry.get('user_query') or ''
+            sql = entry.get('generated_sql')
+            normalized = self.normalize_sql(sql)
+
+            verbatim = sql and not sql_kept
+            if verbatim:
+                line = f"Q: {user_query}\nSQL:\n{sql.strip()}\nA: {self.summarize(entry.get('analysis'))}"
+                sql_kept = True
+            elif sql and normalized in seen_sql:
+                line = f"Q: {user_query} (same SQL as a later turn)"
+            else:
+                line = f"Q: {user_query}\nA: {self.summarize(entry.get('analysis'))}"
+            if normalized:
+                seen_sql.add(normalized)
+
+            tokens = self.estimate_tokens(line)
+            if used + tokens > self.token_budget:
+                if not lines:
+                    # Always keep the latest turn, shortened to the budget without cutting its SQL
+                    lines.append(self._fit_latest(user_query, sql if verbatim else None))
+                break
+            lines.append(line)
+            used += tokens
+
+        context = "\n\n".join(reversed(lines))
+        self._remember(self._compacted, key, context)
+        return context
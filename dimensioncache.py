@@ -0,0 +1,169 @@
+# dimensioncache.py
+import os
+import re
+import logging
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DIMENSION_QUERY = """
+SELECT
+    CAST(s.siteid AS STRING) AS siteid,
+    ANY_VALUE(s.sitename) AS sitename,
+    ANY_VALUE(s.companyId) AS companyId,
+    ANY_VALUE(i.province) AS province,
+    ANY_VALUE(i.area) AS area,
+    STRING_AGG(DISTINCT CAST(i.model AS STRING), ', ') AS model
+FROM `edgepointprod.Axin_Data.site` s
+LEFT JOIN `edgepointprod.Axin_Data.siteinfra` i ON CAST(i.siteid AS STRING) = CAST(s.siteid AS STRING)
+GROUP BY siteid
+"""
+
+# Words in a user query that ask for a dimension column
+DIMENSION_KEYWORDS = {
+    'province': re.compile(r'\bprovinces?\b', re.IGNORECASE),
+    'area': re.compile(r'\bareas?\b', re.IGNORECASE),
+    'model': re.compile(r'\bmodels?\b', re.IGNORECASE),
+}
+
+SITE_ID_COLUMNS = ('siteid', 'site_id')
+MAX_NAME_WORDS = 4
+
+
+def split_company(user_query):
+    """
+    Split a user query into the question and the company ID after its "|" suffix
+
+    :param user_query: The user's question, optionally followed by "| <companyId>"
+    :return: Tuple of (question, companyId or None)
+    """
+    if not user_query or not isinstance(user_query, str):
+        return "", None
+    question, _, company_id = user_query.partition('|')
+    return question.strip(), company_id.strip() or None
+
+
+class DimensionCache:
+    def __init__(self, bigquery_client, refresh_seconds=None):
+        """
+        Initialize the in-process cache of site to company, province, area and model
+
+        :param bigquery_client: Initialized BigQuery client
+        :param refresh_seconds: Seconds between reloads, defaults to DIMENSION_REFRESH_SECONDS
+        """
+        self.client = bigquery_client
+        self.refresh_seconds = float(refresh_seconds or os.getenv("DIMENSION_REFRESH_SECONDS", "3600"))
+        self.sites = pd.DataFrame()
+        self.names = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # Load at startup, then refresh in the background
+        self.load()
+        self._thread = threading.Thread(target=self._refresh_loop, name="dimension-cache", daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """Load the dimension table from BigQuery and swap it in."""
+        try:
+            df = self.client.query(DIMENSION_QUERY).to_dataframe()
+        except Exception as e:
+            logger.error(f"Error loading dimension cache: {e}")
+            return False
+
+        # Index on a lower-cased key so lookups ignore case, keep the original siteid
+        df['siteid'] = df['siteid'].astype(str).str.strip()
+        df['site_key'] = df['siteid'].str.lower()
+        df = df.drop_duplicates('site_key').set_index('site_key')
+        for col in ('companyId', 'province', 'area', 'model'):
+            df[col] = df[col].astype('category')
+        names = {
+            re.sub(r'\s+', ' ', str(name)).strip().lower(): site_key
+            for site_key, name in df['sitename'].items()
+            if isinstance(name, str) and name.strip()
+        }
+
+        with self._lock:
+            self.sites = df
+            self.names = names
+        logger.info(f"✅ Dimension cache loaded {len(df)} sites")
+        return True
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.load()
+
+    def stop(self):
+        """Stop the background refresh."""
+        self._stop.set()
+
+    def resolve_sites(self, user_query, company_id=None):
+        """
+        Resolve site IDs and names mentioned in a user query, within the caller's company
+
+        :param user_query: The user's question, optionally followed by "| <companyId>"
+        :param company_id: Company to resolve sites for, defaults to the query's "|" suffix
+        :return: List of site dictionaries with siteid, sitename, companyId, province, area and model
+        """
+        question, suffix_company = split_company(user_query)
+        company_id = str(company_id).strip() if company_id is not None else suffix_company
+        with self._lock:
+            sites, names = self.sites, self.names
+        # Without a company there is nothing safe to resolve against
+        if sites.empty or not question or not company_id:
+            return []
+
+        words = re.findall(r'[\w-]+', question.lower())
+        found = []
+        for word in words:
+            if word in sites.index:
+                found.append(word)
+        # Site names may span several words
+        for size in range(1, MAX_NAME_WORDS + 1):
+            for start in range(len(words) - size + 1):
+                site_key = names.get(' '.join(words[start:start + size]))
+                if site_key:
+                    found.append(site_key)
+
+        found = list(dict.fromkeys(found))
+        # Only sites of the caller's company, never another company's data
+        return [
+            site for site in (sites.loc[site_key].to_dict() for site_key in found)
+            if str(site.get('companyId')).strip() == company_id
+        ]
+
+    @staticmethod
+    def requested_columns(user_query):
+        """Dimension columns the user query asks for."""
+        if not user_query:
+            return []
+        return [col for col, pattern in DIMENSION_KEYWORDS.items() if pattern.search(user_query)]
+
+    def enrich(self, df, columns):
+        """
+        Add dimension columns to a result in place, keyed on its site ID column
+
+        :param df: Result DataFrame
+        :param columns: Dimension columns to add when missing
+        :return: The same DataFrame
+        """
+        with self._lock:
+            sites = self.sites
+        if df is None or df.empty or sites.empty or not columns:
+            return df
+
+        site_col = next((col for col in df.columns if str(col).lower() in SITE_ID_COLUMNS), None)
+        if site_col is None:
+            return df
+
+        existing = {str(col).lower() for col in df.columns}
+        missing = [col for col in columns if col.lower() not in existing]
+        if not missing:
+            return df
+
+        keys = df[site_col].astype(str).str.strip().str.lower()
+        for col in missing:
+            df[col] = keys.map(sites[col]).astype('category')
+        logger.info(f"Enriched results with {missing} from the dimension cache")
+        return df
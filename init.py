@@ -1,7 +1,13 @@
 import os
+import json
+import uuid
+import queue
+import atexit
 import logging
 import secrets
-from flask import Flask
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import Flask, request
 from flask_session import Session
 from flask_cors import CORS
 from google.cloud import bigquery, storage
@@ -13,16 +19,84 @@ load_dotenv()
 
 
 
+# Request ID of the request being handled, attached to every log record
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_log_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request ID to log records on the calling thread."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def assign_request_id(headers):
+    """Set the request ID from the X-Request-ID header or generate a new one."""
+    request_id = headers.get('X-Request-ID') or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    return request_id
+
+
 def setup_logging():
-    """Configure logging for the application."""
-    logging.basicConfig(
-        level=logging.DEBUG, 
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('app_debug.log')
-        ]
+    """Configure logging for the application.
+
+    Request threads only put records on a queue. A background listener
+    thread formats them and writes to the console and a size-rotated JSON
+    log file. LOG_LEVEL sets the root level and LOG_LEVELS sets per-module
+    levels, e.g. ``kgq=WARNING,modelrouter.decisions=INFO``.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return logging.getLogger(__name__)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+
+    file_handler = RotatingFileHandler(
+        os.getenv("LOG_FILE", "app_debug.log"),
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 ** 2))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5"))
     )
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())
+
+    for item in os.getenv("LOG_LEVELS", "").split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _log_listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
     return logging.getLogger(__name__)
 
 def create_flask_app():
@@ -38,12 +112,27 @@ def create_flask_app():
     # Initialize Flask-Session
     Session(app)
 
+    # Tag every log record of a request with its request ID
+    @app.before_request
+    def set_request_id():
+        assign_request_id(request.headers)
+
+    @app.after_request
+    def add_request_id_header(response):
+        response.headers['X-Request-ID'] = request_id_var.get() or ''
+        return response
+
     # Configure CORS
     CORS(app, resources={
         r"/ask": {
             "origins": ["*"],
             "methods": ["POST"],
             "allow_headers": ["Content-Type"]
+        },
+        r"/ask_batch": {
+            "origins": ["*"],
+            "methods": ["POST"],
+            "allow_headers": ["Content-Type"]
         }
     }, supports_credentials=True)
 
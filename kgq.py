@@ -4,7 +4,10 @@ from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 from io import StringIO
-import re
+import logging
+from querynormalizer import normalize_query, normalize_series
+
+logger = logging.getLogger(__name__)
 
 class KnownGoodQueries:
     def __init__(self, bucket_name="metadata_siteinfra", file_name="knowngoodqueries.csv"):
@@ -13,12 +16,12 @@ class KnownGoodQueries:
         self.queries_df = None
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self.embeddings = None
+        # Normalized query -> SQL of its first occurrence, for exact matches
+        self.exact_index = {}
         # Initialize embeddings after loading queries:
         self.load_queries()
         if self.queries_df is not None and not self.queries_df.empty:
-            self.embeddings = self.model.encode(
-                self.queries_df['user_query'].str.lower().apply(self.preprocess_query).tolist()
-            )
+            self.embeddings = self.model.encode(self.queries_df['normalized_query'].tolist())
 
 
     def load_queries(self):
@@ -27,7 +30,7 @@ class KnownGoodQueries:
             bucket = storage_client.bucket(self.bucket_name)
             blob = bucket.blob(self.file_name)
             
-            print("🔃Downloading file content...")
+            logger.info("🔃Downloading file content...")
             # Download as bytes instead of text
             content_bytes = blob.download_as_bytes()
             content = content_bytes.decode('latin1')
@@ -35,55 +38,69 @@ class KnownGoodQueries:
             if content is None:
                 raise ValueError("❌ Could not decode file with any attempted encoding")
                 
-            self.queries_df = pd.read_csv(StringIO(content), on_bad_lines='skip')
-            print(f"✅Successfully loaded {len(self.queries_df)} queries")
+            queries_df = pd.read_csv(StringIO(content), on_bad_lines='skip')
+            self.queries_df = self._prepare(queries_df)
+            self._index_exact(self.queries_df)
+            logger.info(f"✅Successfully loaded {len(self.queries_df)} queries")
 
         except Exception as e:
-            print(f"Error loading queries {str(e)}")
+            logger.error(f"Error loading queries {str(e)}")
+
+    @staticmethod
+    def _prepare(queries_df):
+        """Add the normalized query column, computed in one vectorized pass."""
+        queries_df = queries_df.reset_index(drop=True)
+        queries_df['normalized_query'] = normalize_series(queries_df['user_query'])
+        return queries_df
+
+    def _index_exact(self, queries_df):
+        """Add rows to the exact match index, keeping the first SQL per normalized query."""
+        for normalized, sql in zip(queries_df['normalized_query'], queries_df['sql_query']):
+            if normalized:
+                self.exact_index.setdefault(normalized, sql)
+
+    def add_queries(self, new_queries_df):
+        """
+        Append known good queries, normalizing and embedding only the new rows
+
+        Nothing calls this yet: the CSV is only read at startup. It is the entry
+        point for adding queries without re-embedding the whole set.
+
+        :param new_queries_df: DataFrame with user_query and sql_query columns
+        """
+        if new_queries_df is None or new_queries_df.empty:
+            return
+
+        new_queries_df = self._prepare(new_queries_df)
+        new_embeddings = self.model.encode(new_queries_df['normalized_query'].tolist())
+
+        if self.queries_df is None or self.queries_df.empty:
+            self.queries_df = new_queries_df
+            self.embeddings = new_embeddings
+        else:
+            self.queries_df = pd.concat([self.queries_df, new_queries_df], ignore_index=True)
+            self.embeddings = np.vstack([self.embeddings, new_embeddings])
+        self._index_exact(new_queries_df)
+        logger.info(f"✅Added {len(new_queries_df)} queries")
 
     def preprocess_query(self, query):
-        # Handle None or empty input
-        if not query or not isinstance(query, str):
-            return ""
-            
-        # Strip company ID and other metadata
-        query = query.split('|')[0] if '|' in query else query
-        
-        query = query.lower().strip()
-        
-        # Expanded stopwords removal
-        stopwords = ['calculate', 'the', 'number', 'of', 'find', 'show', 
-                    'display', 'get', 'me', 'give', 'list']
-        pattern = '|'.join(r'\b{}\b'.format(word) for word in stopwords)
-        query = re.sub(pattern, '', query, flags=re.IGNORECASE)
-        
-        query = re.sub(r'[^\w\s]', '', query)  # Remove punctuation
-        query = re.sub(r'\s+', ' ', query)
-        
-        return query.strip()
+        return normalize_query(query)
 
     def find_exact_match(self, user_query):
-        print(f"\nSearching for exact match for: {user_query}")
+        logger.debug(f"Searching for exact match for: {user_query}")
         if self.queries_df is None:
-            print("❌ No queries loaded")
+            logger.warning("❌ No queries loaded")
             return None
             
         preprocessed_query = self.preprocess_query(user_query)
-        print(f"Preprocessed user query: {preprocessed_query}")
-        
-        for idx, known_query in enumerate(self.queries_df['user_query']):
-            known_preprocessed = self.preprocess_query(known_query)
-            #print(f"\nComparing with known query {idx}:")
-            #print(f"Known: {known_preprocessed}")
-            #print(f"Match: {known_preprocessed == preprocessed_query}")
-            
-        exact_match = self.queries_df[self.queries_df['user_query'].str.lower().apply(self.preprocess_query) == preprocessed_query]
-        return None if exact_match.empty else exact_match.iloc[0]['sql_query']
+        logger.debug(f"Preprocessed user query: {preprocessed_query}")
+
+        return self.exact_index.get(preprocessed_query)
 
     def find_similar_match(self, user_query, similarity_threshold=0.8):
-        print(f"\nSearching for similar match for: {user_query}")
+        logger.debug(f"Searching for similar match for: {user_query}")
         if self.queries_df is None or self.queries_df.empty:
-            print("No queries loaded")
+            logger.warning("No queries loaded")
             return None
 
         preprocessed_query = self.preprocess_query(user_query)
@@ -106,3 +123,36 @@ class KnownGoodQueries:
             return self.queries_df.iloc[best_match_idx]['sql_query']
         
         return None
+
+    def find_matches_batch(self, user_queries, similarity_threshold=0.8):
+        """Resolve a list of queries against the known good queries in one pass.
+
+        Exact matches are looked up first; the remaining queries are embedded
+        together in a single encode call for similarity matching. Returns a
+        list aligned with ``user_queries`` holding the matched SQL or None.
+        """
+        matches = [None] * len(user_queries)
+        if self.queries_df is None or self.queries_df.empty:
+            logger.warning("No queries loaded")
+            return matches
+
+        preprocessed = [self.preprocess_query(query) for query in user_queries]
+
+        pending = []
+        for idx, query in enumerate(preprocessed):
+            if query in self.exact_index:
+                matches[idx] = self.exact_index[query]
+            else:
+                pending.append(idx)
+
+        if pending and self.embeddings is not None:
+            query_embeddings = self.model.encode([preprocessed[idx] for idx in pending])
+            similarities = cosine_similarity(query_embeddings, self.embeddings)
+            best_indices = np.argmax(similarities, axis=1)
+            for row, idx in enumerate(pending):
+                best_match_idx = best_indices[row]
+                if similarities[row][best_match_idx] >= similarity_threshold:
+                    matches[idx] = self.queries_df.iloc[best_match_idx]['sql_query']
+
+        logger.debug(f"Matched {sum(m is not None for m in matches)} of {len(user_queries)} batch queries")
+        return matches
@@ -0,0 +1,122 @@
+# loadtest.py
+"""
+Load test comparing concurrency against memory for the two serving modes.
+
+Start one server, then point the load test at it with the server's PID:
+
+    gunicorn -w 1 --threads 32 -b 0.0.0.0:8000 main:app
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+    python loadtest.py --url http://localhost:8000 --pid <server pid> --concurrency 10 50 100 200
+
+Each level sends --requests-per-client requests from every concurrent client
+and reports throughput, latency percentiles and the server's peak RSS.
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+import httpx
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class MemorySampler:
+    def __init__(self, pid, interval=0.1):
+        """
+        Sample the resident memory of a server process and its children
+
+        :param pid: Process ID of the server
+        :param interval: Seconds between samples
+        """
+        self.process = psutil.Process(pid) if psutil and pid else None
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        processes = [self.process] + self.process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes if p.is_running())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self._rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        if self.process:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.process:
+            self._thread.join()
+
+
+async def run_client(http, url, message, requests_per_client, latencies, errors):
+    # Each client keeps its own session cookie, like a separate conversation
+    cookies = httpx.Cookies()
+    for _ in range(requests_per_client):
+        start = time.perf_counter()
+        try:
+            response = await http.post(f"{url}/ask", json={"message": message}, cookies=cookies)
+            cookies.update(response.cookies)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_level(url, message, concurrency, requests_per_client, pid):
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        with MemorySampler(pid) as sampler:
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                run_client(http, url, message, requests_per_client, latencies, errors)
+                for _ in range(concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_s': statistics.median(latencies),
+        'p95_s': latencies[int(len(latencies) * 0.95) - 1],
+        'peak_rss_mb': sampler.peak_rss / 1024 ** 2 if sampler.process else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--pid', type=int, help='Server process ID, for memory sampling (requires psutil)')
+    parser.add_argument('--message', default='What was the total fuel consumption yesterday?')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--requests-per-client', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.pid and psutil is None:
+        print("psutil is not installed, memory will not be reported")
+
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'peak MB':>8}")
+    for concurrency in args.concurrency:
+        r = asyncio.run(run_level(args.url, args.message, concurrency, args.requests_per_client, args.pid))
+        peak = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else '-'
+        print(f"{r['concurrency']:>11} {r['requests']:>8} {r['errors']:>6} {r['throughput_rps']:>8.2f} "
+              f"{r['p50_s']:>7.2f} {r['p95_s']:>7.2f} {peak:>8}")
+
+
+if __name__ == '__main__':
+    main()
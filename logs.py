@@ -41,4 +41,23 @@ class QueryLogger:
         )
         
         results = self.client.query(query, job_config=job_config).result()
-        return [dict(row) for row in results]
\ No newline at end of file
+        return [dict(row) for row in results]
+
+    def get_query_frequencies(self, days=30):
+        """Count how often each generated SQL was executed over the last ``days`` days."""
+        query = f"""
+        SELECT generated_sql, COUNT(*) AS request_count
+        FROM `{self.table_id}`
+        WHERE generated_sql IS NOT NULL
+          AND DATE(timestamp) >= DATE_SUB(CURRENT_DATE(), INTERVAL @days DAY)
+        GROUP BY generated_sql
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("days", "INTEGER", days)
+            ]
+        )
+        
+        results = self.client.query(query, job_config=job_config).result()
+        return {row['generated_sql']: row['request_count'] for row in results}
\ No newline at end of file
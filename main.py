@@ -1,13 +1,23 @@
-from flask import jsonify, request, session, render_template
+from flask import Response, jsonify, request, session, render_template, stream_with_context
 from flask_session import Session
 from init import create_flask_app, initialize_services, setup_logging
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from buildsql import SQLBuilder
 from analysis import DataAnalyzer
 from history import ConversationHistory
 from metadata_loader import MetadataLoader
 from logs import QueryLogger
-from chathandler import ChatHandler
+from resultstore import ResultStore
+from resultframe import to_records
+from answerstore import AnswerStore
+from chathandler import ChatHandler, QueryType
+from modelrouter import ModelRouter
+from admission import AdmissionController, AdmissionRejected, Priority, priority_var
+from queryguard import QueryRejectedError
+from sqlvalidator import SQLValidationError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import json
 import uuid
 from dotenv import load_dotenv
 import os
@@ -26,6 +36,8 @@ services = initialize_services()
 
 # Initialize OpenAI client
 client = OpenAI(api_key="OPEN API KEY")
+# Async client used by the ASGI serving mode (asgi.py)
+async_client = AsyncOpenAI(api_key=client.api_key)
 # Initialize Metadata Loader
 metadata_loader = MetadataLoader(services['storage_client'])
 metadata = metadata_loader.load_metadata_from_gcs('metadata_siteinfra', 'testingmeta.json')
@@ -34,16 +46,150 @@ metadata = metadata_loader.get_metadata()
 # Initialize Query Logger
 query_logger = QueryLogger(services['bigquery_client'])
 
-chat_handler = ChatHandler(client, query_logger)
+# Initialize Admission Controller, shared by every upstream call
+admission = AdmissionController()
+
+# Initialize Model Router, shared so live statistics cover every call site
+model_router = ModelRouter(admission=admission)
+
+chat_handler = ChatHandler(client, query_logger, async_client, model_router)
 
 # Initialize SQL Builder
 sql_builder = SQLBuilder(
     services['bigquery_client'],
-    client
+    client,
+    async_client,
+    model_router,
+    admission
 )
 
 # Initialize Data Analyzer
-data_analyzer = DataAnalyzer(client)
+data_analyzer = DataAnalyzer(client, async_client, model_router)
+
+# Initialize Result Store
+result_store = ResultStore()
+RESULTS_MAX_PAGE_SIZE = 500
+
+# Initialize Answer Store (filled by warmup.py)
+answer_store = AnswerStore()
+
+# Upper bounds for /ask_batch
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+
+
+def request_priority(data, default):
+    """Priority of a request; clients may only lower it, e.g. {"priority": "report"}."""
+    try:
+        requested = Priority[str(data.get('priority', default.name)).upper()]
+    except KeyError:
+        return default
+    return max(requested, default)
+
+
+def parse_batch_request(data):
+    """Validate an /ask_batch payload, returning (questions, error message)."""
+    if not isinstance(data, dict):
+        return None, "Request body must be a JSON object"
+    questions = data.get('messages', [])
+
+    if not isinstance(questions, list) or not questions:
+        return None, "No messages provided"
+    if not all(isinstance(q, str) and q.strip() for q in questions):
+        return None, "Every message must be a non-empty string"
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return None, f"At most {BATCH_MAX_QUESTIONS} messages per batch"
+    return questions, None
+
+
+def serve_precomputed(user_query, query, session_id):
+    """Answer from the precomputed answer store if ``query`` is a known good query with a fresh answer."""
+    if not query or not answer_store.has_answers():
+        return None
+
+    answer = answer_store.get(query)
+    if answer is None:
+        return None
+
+    logger.info("✅ Served precomputed answer")
+    query_logger.log_query(
+        session_id=session_id,
+        user_query=user_query,
+        generated_sql=query,
+        analysis=answer['analysis']
+    )
+    return build_analysis_response(answer['results_df'], answer['analysis'], query, session_id, answer['notices'])
+
+
+def answer_data_query(user_query, query, session_id):
+    """Execute a generated SQL query, analyze the results and log the interaction."""
+    # Batch generation returns the error in place of the SQL
+    if isinstance(query, SQLValidationError):
+        raise query
+    if not query:
+        raise SQLValidationError("No SQL query could be generated for this question.")
+
+    # Execute query, collecting notices such as an added date filter
+    notices = []
+    results_df = sql_builder.execute_query(query, user_query, notices=notices)
+
+    # Analyze results
+    analysis = data_analyzer.analyze_data(
+        results_df,
+        user_query,
+        results_df
+    )
+
+    # Log the interaction
+    query_logger.log_query(
+        session_id=session_id,
+        user_query=user_query,
+        generated_sql=query,
+        analysis=analysis
+    )
+
+    return build_analysis_response(results_df, analysis, query, session_id, notices)
+
+
+def build_analysis_response(results_df, analysis, query, session_id, notices=None):
+    """Store the results and build the /ask response for a data query."""
+    return {
+        "type": "analysis",
+        "results": to_records(results_df.head(3)) if results_df is not None else [],
+        "result_id": result_store.put(results_df, session_id),
+        "total_rows": len(results_df) if results_df is not None else 0,
+        "analysis": analysis,
+        "notices": notices or [],
+        "query": query
+    }
+
+
+def rejected_response(error):
+    """Build the response for a query the cost guard refused to run."""
+    return {
+        "type": "rejected",
+        "response": (
+            "This question would scan more data than a single query is allowed to. "
+            "Please narrow it down, for example to a date range or specific sites."
+        ),
+        "error": str(error),
+        "query": None,
+        "results": []
+    }
+
+
+def invalid_query_response(error):
+    """Build the response for a question no valid SQL could be built for."""
+    return {
+        "type": "invalid_query",
+        "response": (
+            "I couldn't build a valid query for this question. "
+            "Please rephrase it, naming the metric, sites and dates you need."
+        ),
+        "error": str(error),
+        "query": None,
+        "results": []
+    }
 
 @app.route("/")
 def home():
@@ -62,6 +208,8 @@ def ask():
         if not user_query:
             return jsonify({"error": "No message provided"}), 400
 
+        priority_var.set(request_priority(data, Priority.INTERACTIVE))
+
         # Get or create session ID
         if 'session_id' not in session:
             session['session_id'] = str(uuid.uuid4())
@@ -71,42 +219,27 @@ def ask():
 
         # If it's a data query, proceed with SQL generation and analysis
         if response['type'] == 'data':
+            # Known good queries with a fresh precomputed answer skip the live path
+            known_query = sql_builder.find_known_query(user_query)
+            precomputed = serve_precomputed(user_query, known_query, session['session_id'])
+            if precomputed:
+                return jsonify(precomputed)
+
             # Get conversation history for context
             context = {
+                'session_id': session['session_id'],
                 'conversation_history': query_logger.get_context_history(session['session_id'])
             }
 
-            # Generate SQL query
-            query = sql_builder.generate_sql_query(
+            # Generate SQL query, reusing the known good query matched above
+            query = known_query or sql_builder.generate_sql_query(
                 user_query,
                 metadata,
-                context
+                context,
+                match_known=False
             )
 
-            # Execute query
-            results_df = sql_builder.execute_query(query)
-
-            # Analyze results
-            analysis = data_analyzer.analyze_data(
-                results_df,
-                user_query,
-                results_df
-            )
-
-            # Log the interaction
-            query_logger.log_query(
-                session_id=session['session_id'],
-                user_query=user_query,
-                generated_sql=query,
-                analysis=analysis
-            )
-
-            return jsonify({
-                "type": "analysis",
-                "results": results_df.head(3).to_dict(orient='records') if results_df is not None else [],
-                "analysis": analysis,
-                "query": query
-            })
+            return jsonify(answer_data_query(user_query, query, session['session_id']))
         else:
             # For non-data queries, return the response directly
             return jsonify({
@@ -116,10 +249,128 @@ def ask():
                 "results": []
             })
 
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected by admission control: {e}")
+        return jsonify({"error": str(e)}), 503
+    except QueryRejectedError as e:
+        logger.warning(f"Rejected by query guard: {e}")
+        return jsonify(rejected_response(e)), 422
+    except SQLValidationError as e:
+        logger.warning(f"No valid SQL for query: {e}")
+        return jsonify(invalid_query_response(e)), 422
     except Exception as e:
         logger.error(f"Error in ask route: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/ask_batch', methods=['POST'])
+def ask_batch():
+    """Answer a list of questions, streaming one JSON line per item as it finishes."""
+    try:
+        data = request.get_json(force=True)
+        questions, error = parse_batch_request(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        logger.info(f"Received batch of {len(questions)} queries")
+
+        priority_var.set(request_priority(data, Priority.BATCH))
+
+        if 'session_id' not in session:
+            session['session_id'] = str(uuid.uuid4())
+        session_id = session['session_id']
+
+        # Classify the whole batch in one call
+        query_types = chat_handler.determine_query_types(questions)
+
+        # Generate SQL for all data questions together
+        data_indices = [i for i, t in enumerate(query_types) if t == QueryType.DATA]
+        sql_queries = {}
+        if data_indices:
+            context = {
+                'session_id': session_id,
+                'conversation_history': query_logger.get_context_history(session_id)
+            }
+            generated = sql_builder.generate_sql_queries(
+                [questions[i] for i in data_indices],
+                metadata,
+                context,
+                max_workers=BATCH_MAX_WORKERS
+            )
+            sql_queries = dict(zip(data_indices, generated))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected by admission control: {e}")
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error in ask_batch route: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    def answer(index):
+        user_query = questions[index]
+        try:
+            response = chat_handler.handle_query(user_query, session_id, query_types[index])
+            if response['type'] == 'data':
+                result = answer_data_query(user_query, sql_queries[index], session_id)
+            else:
+                result = {
+                    "type": response['type'],
+                    "response": response['response'],
+                    "query": None,
+                    "results": []
+                }
+        except QueryRejectedError as e:
+            logger.warning(f"Rejected by query guard in ask_batch item {index}: {e}")
+            result = rejected_response(e)
+        except SQLValidationError as e:
+            logger.warning(f"No valid SQL in ask_batch item {index}: {e}")
+            result = invalid_query_response(e)
+        except Exception as e:
+            logger.error(f"Error in ask_batch item {index}: {e}")
+            result = {"type": "error", "error": str(e)}
+        result.update({"index": index, "message": user_query})
+        return result
+
+    def generate():
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+            # Copy the context so worker log records keep the request ID
+            futures = [executor.submit(contextvars.copy_context().run, answer, i) for i in range(len(questions))]
+            for future in as_completed(futures):
+                yield json.dumps(future.result(), default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/results/<result_id>', methods=['GET'])
+def get_results(result_id):
+    """Serve a page of a stored result without re-running its query."""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), RESULTS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers"}), 400
+
+    sort_by = request.args.get('sort')
+    ascending = request.args.get('order', 'asc').lower() != 'desc'
+
+    try:
+        result = result_store.get_page(
+            result_id,
+            session_id=session.get('session_id'),
+            page=page,
+            page_size=page_size,
+            sort_by=sort_by,
+            ascending=ascending
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if result is None:
+        return jsonify({"error": "Result not found or expired"}), 404
+    return jsonify(result)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Admission queue depth and wait time in Prometheus text format."""
+    return Response(admission.metrics_text(), mimetype='text/plain')
+
 @app.route('/history', methods=['GET'])
 def get_history():
     history_manager = ConversationHistory(session)
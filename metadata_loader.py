@@ -1,6 +1,9 @@
 import json
+import logging
 from google.cloud import storage
 
+logger = logging.getLogger(__name__)
+
 class MetadataLoader:
     def __init__(self, storage_client):
         """
@@ -14,17 +17,17 @@ class MetadataLoader:
     def load_metadata_from_gcs(self, bucket_name, blob_name):
         """Load metadata from Google Cloud Storage and save it to a text file."""
         try:
-            print(f"🔃Loading metadata from GCS: bucket={bucket_name}, blob={blob_name}")
+            logger.info(f"🔃Loading metadata from GCS: bucket={bucket_name}, blob={blob_name}")
             bucket = self.storage_client.bucket(bucket_name)
             blob = bucket.blob(blob_name)
             metadata_json = blob.download_as_text()
             self.metadata = json.loads(metadata_json)
 
 
-            print(f"✅ Metadata loaded successfully from {blob_name}")
+            logger.info(f"✅ Metadata loaded successfully from {blob_name}")
             return True
         except Exception as e:
-            print(f"Error loading metadata: {e}")
+            logger.error(f"Error loading metadata: {e}")
             return False
 
     def get_metadata(self):
@@ -0,0 +1,244 @@
+# modelrouter.py
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from admission import AdmissionController
+
+logger = logging.getLogger(__name__)
+
+# Model tiers in order of preference; later models are failover targets
+DEFAULT_ROUTING_TABLE = {
+    'tiers': {
+        'light': ['gpt-3.5-turbo-0125', 'gpt-4o-mini'],
+        'standard': ['gpt-4o-mini', 'gpt-3.5-turbo-0125'],
+        'heavy': ['gpt-4o', 'gpt-4o-mini'],
+    },
+    # Fixed tier per task, or "auto" to route on complexity
+    'tasks': {
+        'classification': 'light',
+        'chat': 'light',
+        'definition': 'light',
+        'column_rename': 'light',
+        'sql_generation': 'auto',
+        'sql_repair': 'standard',
+        'analysis': 'auto',
+    },
+    # Minimum complexity score for each auto-routed tier
+    'thresholds': {'light': 0, 'standard': 2, 'heavy': 6},
+    # Median latency in seconds above which a model is considered degraded
+    'max_latency': {'gpt-3.5-turbo-0125': 5, 'gpt-4o-mini': 10, 'gpt-4o': 20},
+    'max_error_rate': 0.5,
+}
+
+# Errors another model may not hit; anything else (e.g. a 400 for context length) fails on every model
+TRANSIENT_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError)
+
+AGGREGATION_KEYWORDS = re.compile(
+    r'\b(sum|total|average|avg|mean|count|compare|comparison|versus|vs|trend|rank|top|highest|lowest|'
+    r'max(imum)?|min(imum)?|per|group|distribution|percentage|ratio|growth|each|between)\b',
+    re.IGNORECASE
+)
+
+# Words in a user query that imply a table from the SQL generation rules
+TABLE_KEYWORDS = {
+    'dailyfueldata': re.compile(r'\b(fuel|consum\w*|litre|liter)\b', re.IGNORECASE),
+    'performancedaily': re.compile(r'\b(run ?hours?|runtime|performance|uptime)\b', re.IGNORECASE),
+    'siteinfra': re.compile(r'\b(infra\w*|province|area|model|availability|generator|battery|rectifier)\b', re.IGNORECASE),
+}
+
+
+class ModelRouter:
+    def __init__(self, routing_table=None, window=50, stats_ttl=300, admission=None):
+        """
+        Initialize the router that picks a model per LLM request
+
+        :param routing_table: Routing overrides, defaults to MODEL_ROUTING_TABLE (a JSON file
+            path or string); merged per key over DEFAULT_ROUTING_TABLE
+        :param window: Number of recent calls per model used for live statistics
+        :param stats_ttl: Seconds a call counts towards statistics, so degraded models recover
+        :param admission: AdmissionController that rate-limits calls to OpenAI
+        """
+        self.table = self._build_routing_table(routing_table or self._load_routing_table())
+        self.window = window
+        self.stats_ttl = stats_ttl
+        self.admission = admission or AdmissionController()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.decisions = logging.getLogger('modelrouter.decisions')
+
+    @staticmethod
+    def _load_routing_table():
+        config = os.getenv("MODEL_ROUTING_TABLE")
+        if not config:
+            return {}
+        try:
+            if os.path.exists(config):
+                with open(config, encoding='utf-8') as f:
+                    return json.load(f)
+            return json.loads(config)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading model routing table, using defaults: {e}")
+            return {}
+
+    @staticmethod
+    def _merge_routing_table(overrides):
+        """Merge overrides into the defaults, one entry at a time for tiers, tasks, thresholds and max_latency."""
+        table = {key: dict(value) if isinstance(value, dict) else value for key, value in DEFAULT_ROUTING_TABLE.items()}
+        for key, value in overrides.items():
+            if isinstance(table.get(key), dict) and isinstance(value, dict):
+                table[key].update(value)
+            else:
+                table[key] = value
+        return table
+
+    @staticmethod
+    def _routing_table_errors(table):
+        """Return the problems that would make routing fail, e.g. a task routed to an unknown tier."""
+        errors = []
+        tiers = table.get('tiers')
+        if not isinstance(tiers, dict) or not all(isinstance(m, list) and m for m in tiers.values()):
+            return ["tiers must map each tier to a non-empty list of models"]
+        for task, tier in table.get('tasks', {}).items():
+            if tier != 'auto' and tier not in tiers:
+                errors.append(f"task {task} uses unknown tier {tier}")
+        for tier in table.get('thresholds', {}):
+            if tier not in tiers:
+                errors.append(f"threshold for unknown tier {tier}")
+        # Fallbacks used by select_tier
+        for tier in ('light', 'standard'):
+            if tier not in tiers:
+                errors.append(f"tier {tier} is required")
+        return errors
+
+    def _build_routing_table(self, overrides):
+        if not isinstance(overrides, dict):
+            logger.error("Model routing table must be a JSON object, using defaults")
+            overrides = {}
+        table = self._merge_routing_table(overrides)
+        errors = self._routing_table_errors(table)
+        if errors:
+            logger.error(f"Invalid model routing table, using defaults: {'; '.join(errors)}")
+            return self._merge_routing_table({})
+        return table
+
+    def score_complexity(self, user_query, context_length=0):
+        """
+        Score how complex a request is
+
+        :param user_query: The user's question
+        :param context_length: Characters of conversation context in the prompt
+        :return: Complexity score, higher means a more capable model is needed
+        """
+        query = user_query or ''
+        tables = sum(1 for pattern in TABLE_KEYWORDS.values() if pattern.search(query))
+        aggregations = len(AGGREGATION_KEYWORDS.findall(query))
+        # Every table beyond the first means another join
+        return 2 * max(tables - 1, 0) + aggregations + context_length // 2000
+
+    def select_tier(self, task, score=None):
+        """Pick the tier for a task, routing on the score when the task is "auto"."""
+        tier = self.table['tasks'].get(task, 'standard')
+        if tier != 'auto':
+            return tier
+
+        selected = 'light'
+        for name, threshold in sorted(self.table['thresholds'].items(), key=lambda t: t[1]):
+            if (score or 0) >= threshold:
+                selected = name
+        return selected
+
+    def _model_stats(self, model):
+        cutoff = time.monotonic() - self.stats_ttl
+        with self._lock:
+            calls = [(latency, ok) for ts, latency, ok in self._stats.get(model, ()) if ts >= cutoff]
+        if not calls:
+            return {'calls': 0, 'error_rate': 0.0, 'median_latency': 0.0}
+        latencies = sorted(latency for latency, ok in calls if ok)
+        return {
+            'calls': len(calls),
+            'error_rate': sum(1 for _, ok in calls if not ok) / len(calls),
+            'median_latency': latencies[len(latencies) // 2] if latencies else 0.0,
+        }
+
+    def is_degraded(self, model):
+        """Check a model's recent error rate and latency against the routing table."""
+        stats = self._model_stats(model)
+        if stats['calls'] < 5:
+            return False
+        max_latency = self.table['max_latency'].get(model)
+        return (stats['error_rate'] > self.table['max_error_rate']
+                or (max_latency is not None and stats['median_latency'] > max_latency))
+
+    def candidates(self, tier):
+        """Models for a tier, healthy ones first and degraded ones as a last resort."""
+        models = self.table['tiers'][tier]
+        return [m for m in models if not self.is_degraded(m)] + [m for m in models if self.is_degraded(m)]
+
+    def _record(self, model, latency, ok):
+        with self._lock:
+            self._stats.setdefault(model, deque(maxlen=self.window)).append((time.monotonic(), latency, ok))
+
+    def _log_decision(self, task, score, tier, model, latency, ok, attempt):
+        self.decisions.info(json.dumps({
+            'task': task, 'score': score, 'tier': tier, 'model': model,
+            'latency': round(latency, 3), 'ok': ok, 'attempt': attempt,
+        }))
+
+    def complete(self, client, request, task, score=None):
+        """
+        Run a chat completion on the routed model, failing over within the tier
+
+        :param client: OpenAI client
+        :param request: Keyword arguments for chat.completions.create
+        :param task: Task name from the routing table
+        :param score: Complexity score for auto-routed tasks
+        :return: Completion response
+        :raises Exception: The last transient error if every model failed, or a non-transient
+            error (e.g. an invalid request) at once, without failover or marking the model degraded
+        """
+        tier = self.select_tier(task, score)
+        error = None
+        for attempt, model in enumerate(self.candidates(tier)):
+            self.admission.acquire('openai')
+            start = time.perf_counter()
+            try:
+                response = client.chat.completions.create(**dict(request, model=model))
+            except TRANSIENT_ERRORS as e:
+                latency = time.perf_counter() - start
+                self._record(model, latency, False)
+                self._log_decision(task, score, tier, model, latency, False, attempt)
+                logger.warning(f"Model {model} failed for {task}, failing over: {e}")
+                error = e
+                continue
+            latency = time.perf_counter() - start
+            self._record(model, latency, True)
+            self._log_decision(task, score, tier, model, latency, True, attempt)
+            return response
+        raise error
+
+    async def complete_async(self, client, request, task, score=None):
+        """Async variant of complete."""
+        tier = self.select_tier(task, score)
+        error = None
+        for attempt, model in enumerate(self.candidates(tier)):
+            await self.admission.acquire_async('openai')
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(**dict(request, model=model))
+            except TRANSIENT_ERRORS as e:
+                latency = time.perf_counter() - start
+                self._record(model, latency, False)
+                self._log_decision(task, score, tier, model, latency, False, attempt)
+                logger.warning(f"Model {model} failed for {task}, failing over: {e}")
+                error = e
+                continue
+            latency = time.perf_counter() - start
+            self._record(model, latency, True)
+            self._log_decision(task, score, tier, model, latency, True, attempt)
+            return response
+        raise error
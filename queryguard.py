@@ -0,0 +1,163 @@
+# queryguard.py
+import re
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from google.cloud import bigquery
+from sqlvalidator import SQL_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+# Text of each WHERE, ON, HAVING or QUALIFY clause, up to the next clause or subquery
+FILTER_CLAUSE = re.compile(
+    r'(?is)\b(?:WHERE|ON|HAVING|QUALIFY)\b(.*?)(?=\b(?:GROUP\s+BY|ORDER\s+BY|LIMIT|WINDOW|UNION|SELECT|JOIN)\b|$)'
+)
+
+
+class QueryRejectedError(ValueError):
+    """Raised when a query fails the pre-execution cost guard."""
+
+
+class QueryGuard:
+    # Date-partitioned tables and the column their partition filter is on
+    PARTITIONED_TABLES = {
+        'edgepointprod.Axin_Data.dailyfueldata': 'time',
+        'edgepointprod.Axin_Data.performancedaily': 'time',
+    }
+
+    def __init__(self, bigquery_client, maximum_bytes_billed=None, lookback_days=None, cache_size=1024):
+        """
+        Initialize the guard that dry-runs queries before they are executed
+
+        :param bigquery_client: Initialized BigQuery client
+        :param maximum_bytes_billed: Byte limit per query, defaults to BQ_MAXIMUM_BYTES_BILLED
+        :param lookback_days: Days of data a query without a date filter is restricted to
+        :param cache_size: Number of dry-run verdicts kept in memory
+        """
+        self.client = bigquery_client
+        self.maximum_bytes_billed = int(
+            maximum_bytes_billed or os.getenv("BQ_MAXIMUM_BYTES_BILLED", str(10 * 1024 ** 3))
+        )
+        self.lookback_days = int(lookback_days or os.getenv("BQ_DEFAULT_LOOKBACK_DAYS", "30"))
+        self.cache_size = cache_size
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+        self.history = deque(maxlen=1000)
+
+    @staticmethod
+    def sql_hash(sql):
+        """Return a stable hash of the SQL text."""
+        return hashlib.sha256(sql.strip().encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _table_pattern(table):
+        # Matches `project.dataset.table` or project.dataset.table with an optional alias
+        return re.compile(
+            r'(?i)`?' + re.escape(table) + r'`?'
+            r'(\s+(?:AS\s+)?(?!(?:' + '|'.join(sorted(SQL_KEYWORDS)) + r')\b)(\w+))?'
+        )
+
+    @staticmethod
+    def _has_date_predicate(sql, column, qualifier=None):
+        """
+        Check whether the partition column appears in any filter (WHERE, ON, HAVING or QUALIFY)
+
+        Any use counts, e.g. EXTRACT(MONTH FROM d.time) = 3, so an existing filter is never
+        second-guessed; the dry-run byte limit decides whether such a query may run.
+
+        :param qualifier: Alias or table name the column must be qualified with; None matches only the bare column
+        """
+        if qualifier:
+            col = re.compile(r'(?i)\b' + re.escape(qualifier) + r'\.' + re.escape(column) + r'\b')
+        else:
+            col = re.compile(r'(?i)(?<![\w.])' + re.escape(column) + r'\b')
+        return any(col.search(clause) for clause in FILTER_CLAUSE.findall(sql))
+
+    def enforce_partition_filter(self, sql):
+        """Restrict scans on partitioned tables that lack a date predicate.
+
+        Each reference is checked on its own: it counts as filtered if the
+        partition column is filtered through its alias, or unqualified when it
+        is the only partitioned table in the query. Each unfiltered reference
+        is replaced by a subquery limited to the last ``lookback_days`` days.
+
+        :return: Tuple of (possibly rewritten SQL, list of notices describing each rewrite)
+        """
+        notices = []
+        patterns = {table: self._table_pattern(table) for table in self.PARTITIONED_TABLES}
+        references = sum(len(pattern.findall(sql)) for pattern in patterns.values())
+
+        for table, column in self.PARTITIONED_TABLES.items():
+            short_name = table.split('.')[-1]
+
+            def restrict(match):
+                alias = match.group(2) or short_name
+                if self._has_date_predicate(sql, column, alias) or (
+                    references == 1 and self._has_date_predicate(sql, column)
+                ):
+                    return match.group(0)
+                logger.warning(
+                    f"Query on {table} AS {alias} had no date filter; restricted to the last {self.lookback_days} days"
+                )
+                notices.append(
+                    f"{short_name} had no date filter, so only the last {self.lookback_days} days were used."
+                )
+                return (
+                    f"(SELECT * FROM `{table}` "
+                    f"WHERE DATE({column}) >= DATE_SUB(CURRENT_DATE(), INTERVAL {self.lookback_days} DAY)) AS {alias}"
+                )
+
+            sql = patterns[table].sub(restrict, sql)
+        return sql, notices
+
+    def dry_run(self, sql):
+        """Return the estimated bytes processed for ``sql``, using cached verdicts."""
+        key = self.sql_hash(sql)
+        with self._lock:
+            if key in self._verdicts:
+                self._verdicts.move_to_end(key)
+                return self._verdicts[key]
+
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        job = self.client.query(sql, job_config=job_config)
+        estimated = job.total_bytes_processed or 0
+
+        with self._lock:
+            self._verdicts[key] = estimated
+            if len(self._verdicts) > self.cache_size:
+                self._verdicts.popitem(last=False)
+        return estimated
+
+    def check(self, sql):
+        """
+        Guard a query before execution
+
+        :param sql: SQL query to check
+        :return: Tuple of (possibly rewritten SQL, estimated bytes processed, notices for the user)
+        :raises QueryRejectedError: If the estimate exceeds maximum_bytes_billed
+        """
+        sql, notices = self.enforce_partition_filter(sql)
+        estimated = self.dry_run(sql)
+        if estimated > self.maximum_bytes_billed:
+            raise QueryRejectedError(
+                f"Query would process {estimated} bytes, above the limit of {self.maximum_bytes_billed}"
+            )
+        return sql, estimated, notices
+
+    def job_config(self):
+        """Return a job config that enforces maximum_bytes_billed on execution."""
+        return bigquery.QueryJobConfig(maximum_bytes_billed=self.maximum_bytes_billed)
+
+    def record(self, sql, estimated, job):
+        """Record estimated against actual bytes for an executed query."""
+        entry = {
+            'sql_hash': self.sql_hash(sql),
+            'estimated_bytes': estimated,
+            'processed_bytes': job.total_bytes_processed,
+            'billed_bytes': job.total_bytes_billed,
+        }
+        self.history.append(entry)
+        logger.info(f"Query bytes: {entry}")
+        return entry
@@ -0,0 +1,47 @@
+# querynormalizer.py
+import re
+
+STOPWORDS = ['calculate', 'the', 'number', 'of', 'find', 'show',
+             'display', 'get', 'me', 'give', 'list']
+
+# Compiled once and shared by the single-query and vectorized paths
+STOPWORDS_PATTERN = re.compile('|'.join(r'\b{}\b'.format(word) for word in STOPWORDS), re.IGNORECASE)
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """Normalize a single query for matching against known good queries."""
+    # Handle None or empty input
+    if not query or not isinstance(query, str):
+        return ""
+
+    # Strip company ID and other metadata
+    query = query.split('|', 1)[0].lower().strip()
+    query = STOPWORDS_PATTERN.sub('', query)
+    query = PUNCTUATION_PATTERN.sub('', query)
+    query = WHITESPACE_PATTERN.sub(' ', query)
+    return query.strip()
+
+
+def normalize_series(queries):
+    """
+    Normalize a Series of queries in one vectorized pass
+
+    Gives the same result as applying normalize_query to every row.
+
+    :param queries: Series of raw queries
+    :return: Series of normalized queries with the same index
+    """
+    # Non-string values become NaN in the .str operations and end up empty
+    queries = queries.astype(object)
+    return (
+        queries.str.split('|', n=1).str[0]
+        .str.lower()
+        .str.strip()
+        .str.replace(STOPWORDS_PATTERN, '', regex=True)
+        .str.replace(PUNCTUATION_PATTERN, '', regex=True)
+        .str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+        .str.strip()
+        .fillna('')
+    )
@@ -0,0 +1,57 @@
+# resultframe.py
+import pandas as pd
+
+# Object columns with at most this share of distinct values become categoricals
+CATEGORY_RATIO = 0.5
+CATEGORY_MIN_ROWS = 50
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def normalize_results(df):
+    """
+    Shrink a query result DataFrame in place
+
+    Datetimes are made timezone-naive and truncated to the day but kept as
+    datetime64, integers are downcast, floats are downcast only when that is
+    lossless, and low-cardinality string columns become categoricals.
+
+    :param df: Result DataFrame, modified in place
+    :return: The same DataFrame
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            if getattr(series.dt, 'tz', None) is not None:
+                series = series.dt.tz_localize(None)
+            df[col] = series.dt.normalize()
+        elif pd.api.types.is_bool_dtype(series):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            downcast = series.astype('float32')
+            if series.equals(downcast.astype(series.dtype)):
+                df[col] = downcast
+        elif (series.dtype == object or pd.api.types.is_string_dtype(series.dtype)) and len(series) >= CATEGORY_MIN_ROWS:
+            if series.nunique(dropna=True) <= len(series) * CATEGORY_RATIO:
+                df[col] = series.astype('category')
+    return df
+
+
+def format_dates(df):
+    """Return a copy of ``df`` with datetime columns formatted as date strings, for display."""
+    date_cols = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+    if not date_cols:
+        return df
+    df = df.copy()
+    for col in date_cols:
+        df[col] = df[col].dt.strftime(DATE_FORMAT)
+    return df
+
+
+def to_records(df):
+    """Convert a (small) result DataFrame to JSON-safe records."""
+    if df is None:
+        return []
+    df = format_dates(df)
+    return df.astype(object).where(pd.notna(df), None).to_dict(orient='records')
@@ -0,0 +1,134 @@
+# resultstore.py
+import os
+import uuid
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from resultframe import to_records
+
+logger = logging.getLogger(__name__)
+
+
+class ResultStore:
+    def __init__(self, directory=None, max_bytes=None, max_entries=None):
+        """
+        Initialize the on-disk store for executed query results
+
+        :param directory: Directory the Parquet files are written to
+        :param max_bytes: Total size of stored results before the least recently used are evicted
+        :param max_entries: Maximum number of stored results
+        """
+        self.root = directory or os.getenv("RESULT_STORE_DIR", "result_store")
+        # Each process writes to its own subdirectory, so workers never remove each other's results
+        self.directory = os.path.join(self.root, str(os.getpid()))
+        self.max_bytes = int(max_bytes or os.getenv("RESULT_STORE_MAX_BYTES", str(512 * 1024 ** 2)))
+        self.max_entries = int(max_entries or os.getenv("RESULT_STORE_MAX_ENTRIES", "1000"))
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_orphans()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _pid_running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _remove_orphans(self):
+        """Remove results left by processes that are no longer running or by an earlier process with this PID."""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path) or not name.isdigit():
+                continue
+            if int(name) == os.getpid() or not self._pid_running(int(name)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, result_id):
+        return os.path.join(self.directory, f"{result_id}.parquet")
+
+    def _evict(self):
+        """Remove least recently used results until the store is within its limits."""
+        while self._entries and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            result_id, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry['size']
+            try:
+                os.remove(self._path(result_id))
+            except OSError as e:
+                logger.warning(f"Could not remove stored result {result_id}: {e}")
+
+    def put(self, df, session_id=None):
+        """
+        Store a result DataFrame
+
+        :param df: Result DataFrame
+        :param session_id: Session allowed to read the result
+        :return: Result ID, or None if the result could not be stored
+        """
+        if df is None or df.empty:
+            return None
+
+        result_id = uuid.uuid4().hex
+        path = self._path(result_id)
+        try:
+            df.to_parquet(path, index=False, compression='zstd')
+        except Exception as e:
+            logger.error(f"Error storing result: {e}")
+            return None
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._entries[result_id] = {'size': size, 'session_id': session_id, 'rows': len(df)}
+            self._total_bytes += size
+            self._evict()
+        return result_id
+
+    def get_page(self, result_id, session_id=None, page=1, page_size=50, sort_by=None, ascending=True):
+        """
+        Read one page of a stored result
+
+        :param result_id: ID returned by put
+        :param session_id: Session requesting the result
+        :param page: 1-based page number
+        :param page_size: Rows per page
+        :param sort_by: Optional column to sort by
+        :param ascending: Sort direction
+        :return: Page dictionary, or None if the result is unknown
+        """
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None or entry['session_id'] != session_id:
+                return None
+            self._entries.move_to_end(result_id)
+
+        try:
+            df = pd.read_parquet(self._path(result_id))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading stored result {result_id}: {e}")
+            return None
+
+        if sort_by is not None:
+            if sort_by not in df.columns:
+                raise ValueError(f"Unknown sort column: {sort_by}")
+            df.sort_values(sort_by, ascending=ascending, inplace=True, na_position='last')
+
+        start = (page - 1) * page_size
+        page_df = df.iloc[start:start + page_size]
+
+        return {
+            'result_id': result_id,
+            'columns': list(df.columns),
+            'rows': to_records(page_df),
+            'page': page,
+            'page_size': page_size,
+            'total_rows': entry['rows'],
+            'total_pages': (entry['rows'] + page_size - 1) // page_size,
+        }
@@ -0,0 +1,234 @@
+# sqlvalidator.py
+import re
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Functions from other SQL dialects that BigQuery does not support
+UNSUPPORTED_FUNCTIONS = {
+    'GETDATE': 'CURRENT_DATE() or CURRENT_TIMESTAMP()',
+    'NOW': 'CURRENT_TIMESTAMP()',
+    'DATEADD': 'DATE_ADD()',
+    'DATEDIFF': 'DATE_DIFF()',
+    'ISNULL': 'IFNULL()',
+    'NVL': 'IFNULL()',
+    'LEN': 'LENGTH()',
+    'TO_DATE': 'PARSE_DATE() or DATE()',
+}
+
+FORBIDDEN_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'DROP', 'CREATE', 'ALTER', 'MERGE', 'TRUNCATE')
+
+# BigQuery error reasons that fail the same way on every run, e.g. syntax errors or unknown columns
+DETERMINISTIC_ERROR_REASONS = {'invalidQuery'}
+
+# Table references after FROM or JOIN; UNNEST(...) produces rows from an array, not a table
+TABLE_REF = re.compile(r'(?i)\b(?:FROM|JOIN)\s+(?!UNNEST\s*\()(`[^`]+`|[\w.-]+)(?:\s+(?:AS\s+)?(\w+))?')
+# Expressions whose syntax contains FROM without referencing a table
+FROM_FUNCTIONS = re.compile(r'(?i)\b(?:EXTRACT|TRIM|SUBSTRING)\s*\(')
+DISTINCT_FROM = re.compile(r'(?i)\bDISTINCT\s+FROM\b')
+FROM_KEYWORD = re.compile(r'(?i)\bFROM\b')
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'" r'|"(?:[^"\\]|\\.)*"')
+CTE_NAME = re.compile(r'(?i)(?:\bWITH|,)\s*(\w+)\s+AS\s*\(')
+QUALIFIED_COLUMN = re.compile(r'\b(\w+)\.(\w+)\b')
+# Keywords that can follow a table reference, so they are never its alias (shared with queryguard)
+SQL_KEYWORDS = {
+    'WHERE', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'FULL', 'CROSS', 'ON', 'GROUP',
+    'ORDER', 'LIMIT', 'UNION', 'USING', 'HAVING', 'WINDOW', 'QUALIFY',
+    'TABLESAMPLE', 'EXCEPT', 'INTERSECT', 'FOR',
+}
+
+
+class SQLValidationError(ValueError):
+    """Raised when no valid SQL could be built for a question, or the SQL is known to fail."""
+
+    def __init__(self, errors):
+        self.errors = [errors] if isinstance(errors, str) else list(errors)
+        super().__init__("; ".join(self.errors))
+
+
+class SQLValidator:
+    def __init__(self, metadata):
+        """
+        Initialize the validator with the loaded metadata schema
+
+        :param metadata: Metadata dictionary as returned by MetadataLoader
+        """
+        self.metadata = metadata
+        self.schema = self._schema_from_metadata(metadata)
+
+    @staticmethod
+    def _column_names(columns):
+        """Extract column names from a list or dict of column descriptions."""
+        if isinstance(columns, dict):
+            return {name.lower() for name in columns}
+        names = set()
+        for column in columns or []:
+            if isinstance(column, str):
+                names.add(column.lower())
+            elif isinstance(column, dict):
+                name = column.get('name') or column.get('column_name') or column.get('column')
+                if name:
+                    names.add(str(name).lower())
+        return names
+
+    @classmethod
+    def _schema_from_metadata(cls, metadata):
+        """Build a {table name: set of columns} mapping from the metadata."""
+        schema = {}
+        if not metadata:
+            return schema
+
+        tables = metadata.get('tables', metadata) if isinstance(metadata, dict) else metadata
+        if isinstance(tables, dict):
+            tables = [
+                dict(value, table_name=name) if isinstance(value, dict) and 'columns' in value
+                else {'table_name': name, 'columns': value}
+                for name, value in tables.items()
+            ]
+
+        for table in tables if isinstance(tables, list) else []:
+            if not isinstance(table, dict):
+                continue
+            name = table.get('table_name') or table.get('name') or table.get('table')
+            if not name:
+                continue
+            schema[str(name).split('.')[-1].lower()] = cls._column_names(table.get('columns'))
+        return schema
+
+    @staticmethod
+    def _strip_literals(sql, placeholder="''"):
+        """Remove single and double quoted string literals and comments so they are not validated as SQL."""
+        sql = re.sub(r'--[^\n]*', ' ', sql)
+        sql = re.sub(r'/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+        return STRING_LITERAL.sub(placeholder, sql)
+
+    @staticmethod
+    def _mask_expression_from(sql):
+        """Blank out FROM inside EXTRACT, TRIM, SUBSTRING and IS DISTINCT FROM, keeping clause-level FROM."""
+        chars = list(sql)
+        for match in DISTINCT_FROM.finditer(sql):
+            chars[match.end() - 4:match.end()] = '    '
+
+        for match in FROM_FUNCTIONS.finditer(sql):
+            depth = 1
+            for i in range(match.end(), len(sql)):
+                if sql[i] == '(':
+                    depth += 1
+                elif sql[i] == ')':
+                    depth -= 1
+                    if not depth:
+                        break
+                # Only the function's own FROM, not one in a nested subquery
+                elif depth == 1 and FROM_KEYWORD.match(sql, i) and not re.match(r'\w', sql[i - 1]):
+                    chars[i:i + 4] = '    '
+        return ''.join(chars)
+
+    def _check_syntax(self, sql):
+        errors = []
+        stripped = self._strip_literals(sql)
+
+        if not re.match(r'(?i)\s*(SELECT|WITH)\b', stripped):
+            errors.append("Query must start with SELECT or WITH.")
+        forbidden = [word for word in FORBIDDEN_STATEMENTS if re.search(rf'(?i)\b{word}\b', stripped)]
+        if forbidden:
+            errors.append(f"Only read-only SELECT queries are allowed, found: {', '.join(forbidden)}.")
+        if stripped.strip().rstrip(';').count(';'):
+            errors.append("Query must be a single statement.")
+        if stripped.count('(') != stripped.count(')'):
+            errors.append("Unbalanced parentheses.")
+        if stripped.count('`') % 2:
+            errors.append("Unbalanced backticks.")
+        if re.search(r"""['"]""", self._strip_literals(sql, placeholder=' ')):
+            errors.append("Unterminated string literal.")
+        if re.search(r'(?i)\bSELECT\s+TOP\s+\d+', stripped):
+            errors.append("BigQuery does not support SELECT TOP; use LIMIT instead.")
+        for function, replacement in UNSUPPORTED_FUNCTIONS.items():
+            if re.search(rf'(?i)\b{function}\s*\(', stripped):
+                errors.append(f"{function}() is not a BigQuery function; use {replacement}.")
+        return errors
+
+    def _check_schema(self, sql):
+        errors = []
+        if not self.schema:
+            return errors
+
+        stripped = self._strip_literals(sql)
+        ctes = {name.lower() for name in CTE_NAME.findall(stripped)}
+        aliases = {}
+
+        for table_ref, alias in TABLE_REF.findall(self._mask_expression_from(stripped)):
+            table = table_ref.strip('`').split('.')[-1].lower()
+            if table in ctes:
+                continue
+            if table not in self.schema:
+                errors.append(f"Unknown table: {table_ref.strip('`')}.")
+                continue
+            aliases[table] = table
+            if alias and alias.upper() not in SQL_KEYWORDS:
+                aliases[alias.lower()] = table
+
+        for qualifier, column in QUALIFIED_COLUMN.findall(stripped):
+            table = aliases.get(qualifier.lower())
+            columns = self.schema.get(table) if table else None
+            if columns and column.lower() not in columns:
+                errors.append(f"Unknown column {column} in table {table}.")
+        return sorted(set(errors), key=errors.index)
+
+    def validate(self, sql):
+        """
+        Validate SQL against the metadata schema and BigQuery dialect basics
+
+        :param sql: SQL query to validate
+        :return: List of validation error messages, empty if the query is valid
+        """
+        if not sql or not isinstance(sql, str) or not sql.strip():
+            return ["Query is empty."]
+        return self._check_syntax(sql) + self._check_schema(sql)
+
+
+class FailedQueryCache:
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        Initialize the negative cache of SQL that failed validation or execution
+
+        :param max_size: Maximum number of failed queries remembered
+        :param ttl: Seconds a failure is remembered, defaults to FAILED_QUERY_TTL_SECONDS
+        """
+        self.max_size = max_size
+        self.ttl = float(ttl or os.getenv("FAILED_QUERY_TTL_SECONDS", "3600"))
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(sql):
+        return hashlib.sha256(sql.strip().encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_deterministic(error):
+        """Check whether a BigQuery error would recur on retry, as opposed to resource limits or transient failures."""
+        reasons = {e.get('reason') for e in getattr(error, 'errors', None) or [] if isinstance(e, dict)}
+        return bool(reasons) and reasons <= DETERMINISTIC_ERROR_REASONS
+
+    def add(self, sql, error):
+        """Remember that ``sql`` failed with ``error``."""
+        key = self._key(sql)
+        with self._lock:
+            self._failures[key] = (str(error), time.monotonic() + self.ttl)
+            self._failures.move_to_end(key)
+            if len(self._failures) > self.max_size:
+                self._failures.popitem(last=False)
+
+    def get(self, sql):
+        """Return the recorded error for ``sql``, or None if it has not failed or the failure expired."""
+        key = self._key(sql)
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None:
+                return None
+            error, expires = failure
+            if time.monotonic() >= expires:
+                del self._failures[key]
+                return None
+            return error
@@ -0,0 +1,121 @@
+# warmup.py
+"""
+Precompute answers for the most requested known good queries.
+
+Schedule once a day after the daily data load, for example with cron:
+
+    30 6 * * * cd /app && python warmup.py --top 50
+
+Request frequency is read from the execution logs, so the warm-up set
+follows what users actually ask.
+
+Only the components the warm-up needs are built here; importing main would
+also start the web app and its per-process stores.
+
+Admission control is per process, so the server's queue does not see the
+warm-up's REPORT priority. The job therefore runs with its own low rate
+limits (WARMUP_<UPSTREAM>_RATE/_BURST) to leave the shared quota to the server.
+"""
+import os
+import argparse
+import logging
+from dotenv import load_dotenv
+from openai import OpenAI
+from init import initialize_services, setup_logging
+from admission import AdmissionController, Priority, priority_var
+from modelrouter import ModelRouter
+from buildsql import SQLBuilder
+from analysis import DataAnalyzer
+from logs import QueryLogger
+from answerstore import AnswerStore
+
+logger = logging.getLogger(__name__)
+
+# Requests per second and burst per upstream for the warm-up job
+WARMUP_LIMITS = {'openai': (2, 4), 'bigquery': (1, 2)}
+
+
+def build_components():
+    """Initialize the clients and components used by the warm-up job."""
+    services = initialize_services()
+    client = OpenAI(api_key=services['openai_api_key'])
+    admission = AdmissionController(limits={
+        name: (
+            float(os.getenv(f"WARMUP_{name.upper()}_RATE", rate)),
+            float(os.getenv(f"WARMUP_{name.upper()}_BURST", burst)),
+        )
+        for name, (rate, burst) in WARMUP_LIMITS.items()
+    })
+    model_router = ModelRouter(admission=admission)
+    return {
+        'sql_builder': SQLBuilder(services['bigquery_client'], client, model_router=model_router, admission=admission),
+        'data_analyzer': DataAnalyzer(client, model_router=model_router),
+        'query_logger': QueryLogger(services['bigquery_client']),
+        'answer_store': AnswerStore(),
+    }
+
+
+def select_queries(components, top, days):
+    """Pick the known good queries with the most executions in the last ``days`` days."""
+    sql_builder, query_logger = components['sql_builder'], components['query_logger']
+    kgq_df = sql_builder.kgq.queries_df
+    if kgq_df is None or kgq_df.empty:
+        logger.error("No known good queries loaded")
+        return []
+
+    frequencies = query_logger.get_query_frequencies(days)
+    ranked = []
+    seen = set()
+    for user_query, sql in zip(kgq_df['user_query'], kgq_df['sql_query']):
+        if not isinstance(sql, str) or sql in seen:
+            continue
+        seen.add(sql)
+        ranked.append({'user_query': user_query, 'sql': sql, 'request_count': frequencies.get(sql, 0)})
+
+    ranked.sort(key=lambda q: q['request_count'], reverse=True)
+    return ranked[:top]
+
+
+def warm_up(components, top, days):
+    sql_builder, data_analyzer = components['sql_builder'], components['data_analyzer']
+    answers = []
+    failed = []
+    for entry in select_queries(components, top, days):
+        # A failed query must not be stored as "no data"; keep its previous answer instead
+        notices = []
+        try:
+            results_df = sql_builder.execute_query(
+                entry['sql'], entry['user_query'], raise_errors=True, notices=notices
+            )
+        except Exception as e:
+            logger.error(f"Skipping {entry['user_query']}, query failed: {e}")
+            failed.append(entry['sql'])
+            continue
+
+        analysis = data_analyzer.analyze_data(results_df, entry['user_query'], results_df)
+        if analysis.startswith("Analysis error"):
+            logger.error(f"Skipping {entry['user_query']}, {analysis}")
+            failed.append(entry['sql'])
+            continue
+
+        answers.append(dict(entry, results_df=results_df, analysis=analysis, notices=notices))
+        logger.info(f"Precomputed answer for: {entry['user_query']} ({entry['request_count']} requests)")
+
+    components['answer_store'].save(answers, keep=failed)
+    return len(answers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=50, help='Number of known good queries to precompute')
+    parser.add_argument('--days', type=int, default=30, help='Days of execution logs used to rank queries')
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging()
+    components = build_components()
+
+    # Orders the job's own calls only; the server's queue is in another process
+    priority_var.set(Priority.REPORT)
+
+    print(f"✅Precomputed {warm_up(components, args.top, args.days)} answers")